@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8 :
+# vim: set et ts=4 sw=4:
+'''
+Benchmarks of the manatools.pkgs API against synthetic repositories.
+
+    python3 bench/run.py [--sizes 1000,10000] [--baseline bench/baseline.json]
+                         [--save-baseline] [--threshold 0.25] [--repeat 5]
+                         [--json out.json]
+
+Every operation is run once as warm-up and then timed repeat times, the
+best time (seconds) is kept. Operations that cannot be repeated, such as
+the first sack load, are timed once. The python memory peak (tracemalloc,
+bytes) of the first run and the growth of the process maximum resident
+set size (bytes, it includes libsolv memory that tracemalloc does not
+see) are recorded. Results are compared with the baseline file if any,
+the exit code is 1 if an operation is slower or takes more memory than
+the baseline by more than threshold.
+Nothing is read from the system repositories, the rpmdb of an empty
+installroot is used, so there are no installed packages.
+
+License: LGPLv2+
+
+@package bench.run
+'''
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import resource
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dnf
+import dnf.repo
+
+import synthrepo
+from manatools.pkgs import dnfbackend
+from manatools.pkgs import packages
+from manatools.pkgs import functions
+from manatools.pkgs import snapshot
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+''' memory values (bytes) below this are not reported as regressions '''
+MIN_MEMORY = 1024 * 1024
+
+
+def max_rss():
+    '''
+    return the process maximum resident set size in bytes
+    '''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on darwin
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class Bench:
+    '''
+    runs and records the benchmarks of one synthetic repository size
+    '''
+
+    def __init__(self, size, workdir, repeat=5):
+        self.size = size
+        self.workdir = workdir
+        self.repeat = max(1, repeat)
+        self.results = {}
+        self.base = None
+
+    def measure(self, name, func, *args, **kwargs):
+        '''
+        record time and memory of func(*args), once=True if it cannot
+        be repeated, returns the result of the first run
+        '''
+        once = kwargs.get('once', False)
+        rss = max_rss()
+        # first run, memory is traced here only
+        tracemalloc.start()
+        start = perf_counter()
+        result = func(*args)
+        elapsed = perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if not once:
+            elapsed = None
+            for i in range(self.repeat):
+                start = perf_counter()
+                func(*args)
+                t = perf_counter() - start
+                elapsed = t if elapsed is None else min(elapsed, t)
+        rss = max_rss() - rss
+        self.results[name] = {'time': elapsed, 'memory': peak, 'rss': rss}
+        print("  %-28s %9.4f s %12d B %12d B rss" % (name, elapsed, peak, rss))
+        return result
+
+    def _new_base(self):
+        root = os.path.join(self.workdir, 'root')
+        base = dnfbackend.DnfBase(setup_sack=True, lazy=True)
+        base.repos.clear()
+        base.conf.installroot = root
+        base.conf.cachedir = os.path.join(self.workdir, 'cache')
+        repo = dnf.repo.Repo('synthetic', base.conf)
+        repo.baseurl = ['file://%s' % os.path.join(self.workdir, 'repo')]
+        repo.gpgcheck = False
+        base.repos.add(repo)
+        repo.enable()
+        base.ensure_sack()
+        return base
+
+    def _queue(self, pkgs):
+        queue = packages.PackageQueue()
+        queue.add_many(pkgs, 'i')
+        queue.remove_many(pkgs)
+
+    def _cold(self, name):
+        self.base.packages.invalidate()
+        return getattr(self.base.packages, name)
+
+    def _protected(self, persisted=False):
+        # nothing memoized, the persisted keys are removed unless persisted
+        self.base.packages.refresh()
+        if not persisted:
+            path = snapshot.cache_path(self.base, packages.PROTECTED_CACHE)
+            if os.path.exists(path):
+                os.remove(path)
+        return list(self.base.packages.protected)
+
+    def run(self):
+        repo = os.path.join(self.workdir, 'repo')
+        npkgs = synthrepo.generate(repo, self.size)
+        print("%d names, %d packages" % (self.size, npkgs))
+        protected = os.path.join(self.workdir, 'protected.d')
+        os.makedirs(protected)
+        with open(os.path.join(protected, 'bench.conf'), 'w') as f:
+            for i in range(0, self.size, max(1, self.size // 20)):
+                f.write(synthrepo.pkg_name(i) + '\n')
+        packages.PROTECTED_CONF_PATH = protected
+
+        self.base = self.measure('startup', self._new_base, once=True)
+        self.measure('startup.warm', lambda: self._new_base().close())
+        for name in ('all', 'available', 'updates', 'extras', 'installed'):
+            self.measure('packages.%s' % name, self._cold, name)
+        self.measure('packages.all.memoized', getattr, self.base.packages, 'all')
+        self.measure('packages.recent', lambda: self._cold('recent')())
+        self.measure('packages.recent.indexed', self.base.packages.recent, 3)
+
+        fields = ['name', 'summary', 'description']
+        self.measure('search', lambda: list(self.base.search(fields, ['hex', 'edit'])))
+        self.measure('search.index.build', lambda: self.base.search_index, once=True)
+        self.measure('search.index', self.base.search, fields, ['hex', 'edit'], True, False, None, True)
+
+        names = [synthrepo.pkg_name(i) for i in range(min(self.size, 3000))]
+        self.measure('packagesByNames', functions.packagesByNames, self.base, names)
+        found, missing = functions.packagesByNames(self.base, names)
+        pkgs = list(found.values())
+        self.measure('PackageQueue.add_remove', self._queue, pkgs)
+
+        self.base.packageQueue.add_many(pkgs, 'i')
+        self.measure('packagesToInstall', functions.packagesToInstall, self.base)
+        self.measure('protected', self._protected)
+        self.measure('protected.persisted', self._protected, True)
+        self.measure('unselectAllPackages', functions.unselectAllPackages, self.base, once=True)
+        self.base.close()
+        return self.results
+
+
+def compare(results, baseline, threshold):
+    '''
+    print the comparison with baseline, returns the regressions
+    '''
+    regressions = []
+    for size, ops in sorted(results.items()):
+        for name, value in sorted(ops.items()):
+            old = baseline.get(size, {}).get(name)
+            if not old:
+                continue
+            for what, floor, label in (('time', 0, 'slower'),
+                                       ('memory', MIN_MEMORY, 'more python memory'),
+                                       ('rss', MIN_MEMORY, 'more rss')):
+                # older baselines may not have all the values, small memory
+                # values are compared with floor
+                reference = max(old.get(what) or 0, floor)
+                if not reference or what not in value:
+                    continue
+                ratio = value[what] / float(reference)
+                if ratio > 1 + threshold:
+                    regressions.append((size, name, what, ratio))
+                    print("REGRESSION %s %-28s %.2fx %s" % (size, name, ratio, label))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='manatools.pkgs benchmarks')
+    parser.add_argument('--sizes', default='1000,10000',
+                        help='comma separated synthetic repository sizes (package names)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline file')
+    parser.add_argument('--save-baseline', action='store_true', help='store results as baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='slow down (or memory growth) ratio reported as regression')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='timed runs of every operation after the warm-up, the best is kept')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    results = {}
+    for size in [int(s) for s in args.sizes.split(',')]:
+        workdir = tempfile.mkdtemp(prefix='manatools-bench-')
+        try:
+            results[str(size)] = Bench(size, workdir, args.repeat).run()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
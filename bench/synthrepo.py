@@ -0,0 +1,146 @@
+# vim: set fileencoding=utf-8 :
+# vim: set et ts=4 sw=4:
+'''
+Synthetic rpm-md repository generator for the manatools.pkgs benchmarks.
+
+Only the repository metadata (repomd.xml, primary, filelists and other)
+is written, there are no rpm files, that is enough to fill a dnf sack.
+
+License: LGPLv2+
+
+@package bench.synthrepo
+'''
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import gzip
+import random
+import hashlib
+from time import time
+from xml.sax.saxutils import escape
+
+WORDS = ('editor', 'library', 'network', 'daemon', 'python', 'graphics', 'audio',
+         'video', 'kernel', 'utility', 'game', 'hex', 'fire', 'wall', 'shell',
+         'terminal', 'desktop', 'theme', 'font', 'devel', 'docs', 'server',
+         'client', 'parser', 'compiler', 'manager', 'package', 'tool')
+
+PRIMARY_NS = ('xmlns="http://linux.duke.edu/metadata/common" '
+              'xmlns:rpm="http://linux.duke.edu/metadata/rpm"')
+
+
+def pkg_name(i):
+    return "synth-%s-%06d" % (WORDS[i % len(WORDS)], i)
+
+def _sentence(rnd, n):
+    return ' '.join(rnd.choice(WORDS) for _ in range(n))
+
+def _packages(count, seed, recent_days):
+    '''
+    yield the synthetic package dictionaries, some packages have
+    more versions and requirements on other packages
+    '''
+    rnd = random.Random(seed)
+    now = int(time())
+    for i in range(count):
+        versions = 2 if i % 10 == 0 else 1
+        for v in range(versions):
+            buildtime = now - rnd.randint(0, recent_days * 2) * 86400
+            requires = [pkg_name(rnd.randrange(count)) for _ in range(rnd.randint(0, 3))]
+            yield {
+                'name'       : pkg_name(i),
+                'epoch'      : '0',
+                'version'    : '1.%d' % v,
+                'release'    : '1',
+                'arch'       : 'x86_64' if i % 7 else 'noarch',
+                'summary'    : _sentence(rnd, 5),
+                'description': _sentence(rnd, 40),
+                'url'        : 'https://example.org/%s' % pkg_name(i),
+                'buildtime'  : buildtime,
+                'size'       : rnd.randint(10000, 5000000),
+                'requires'   : [r for r in requires if r != pkg_name(i)],
+                'pkgid'      : hashlib.sha256(('%d-%d' % (i, v)).encode('utf-8')).hexdigest(),
+            }
+
+def _primary(pkg):
+    nevr = 'epoch="%(epoch)s" ver="%(version)s" rel="%(release)s"' % pkg
+    provides = '<rpm:entry name="%s" flags="EQ" %s/>' % (pkg['name'], nevr)
+    requires = ''.join('<rpm:entry name="%s"/>' % r for r in pkg['requires'])
+    return (
+        '<package type="rpm"><name>%(name)s</name><arch>%(arch)s</arch>'
+        '<version ' + nevr + '/>'
+        '<checksum type="sha256" pkgid="YES">%(pkgid)s</checksum>'
+        '<summary>%(summary)s</summary><description>%(description)s</description>'
+        '<packager>bench</packager><url>%(url)s</url>'
+        '<time file="%(buildtime)d" build="%(buildtime)d"/>'
+        '<size package="%(size)d" installed="%(size)d" archive="%(size)d"/>'
+        '<location href="Packages/%(name)s-%(version)s-%(release)s.%(arch)s.rpm"/>'
+        '<format><rpm:license>MIT</rpm:license><rpm:vendor>bench</rpm:vendor>'
+        '<rpm:group>Unspecified</rpm:group><rpm:buildhost>bench</rpm:buildhost>'
+        '<rpm:sourcerpm>%(name)s-%(version)s-%(release)s.src.rpm</rpm:sourcerpm>'
+        '<rpm:header-range start="4504" end="5000"/>'
+        '<rpm:provides>' + provides + '</rpm:provides>'
+        '<rpm:requires>' + requires + '</rpm:requires>'
+        '<file>/usr/bin/%(name)s</file></format></package>\n') % dict(
+            pkg, summary=escape(pkg['summary']), description=escape(pkg['description']))
+
+def _filelists(pkg):
+    return ('<package pkgid="%(pkgid)s" name="%(name)s" arch="%(arch)s">'
+            '<version epoch="%(epoch)s" ver="%(version)s" rel="%(release)s"/>'
+            '<file>/usr/bin/%(name)s</file></package>\n') % pkg
+
+def _other(pkg):
+    return ('<package pkgid="%(pkgid)s" name="%(name)s" arch="%(arch)s">'
+            '<version epoch="%(epoch)s" ver="%(version)s" rel="%(release)s"/>'
+            '</package>\n') % pkg
+
+def _write_gz(path, head, body, tail):
+    '''
+    write a gzipped xml file, returns (checksum, open checksum, size, open size)
+    '''
+    data = (head + ''.join(body) + tail).encode('utf-8')
+    with gzip.open(path, 'wb') as f:
+        f.write(data)
+    with open(path, 'rb') as f:
+        gz = f.read()
+    return (hashlib.sha256(gz).hexdigest(), hashlib.sha256(data).hexdigest(),
+            len(gz), len(data))
+
+def generate(path, count, seed=0, recent_days=7):
+    '''
+    write a synthetic repository with count package names into path,
+    returns the number of packages (some names have two versions)
+    '''
+    repodata = os.path.join(path, 'repodata')
+    if not os.path.isdir(repodata):
+        os.makedirs(repodata)
+    pkgs = list(_packages(count, seed, recent_days))
+    n = len(pkgs)
+    files = {
+        'primary'  : ('<?xml version="1.0" encoding="UTF-8"?>\n<metadata %s packages="%d">\n' % (PRIMARY_NS, n),
+                      [_primary(p) for p in pkgs], '</metadata>\n'),
+        'filelists': ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                      '<filelists xmlns="http://linux.duke.edu/metadata/filelists" packages="%d">\n' % n,
+                      [_filelists(p) for p in pkgs], '</filelists>\n'),
+        'other'    : ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                      '<otherdata xmlns="http://linux.duke.edu/metadata/other" packages="%d">\n' % n,
+                      [_other(p) for p in pkgs], '</otherdata>\n'),
+    }
+    now = int(time())
+    data = []
+    for kind, (head, body, tail) in sorted(files.items()):
+        name = '%s.xml.gz' % kind
+        checksum, open_checksum, size, open_size = _write_gz(os.path.join(repodata, name), head, body, tail)
+        data.append(
+            '<data type="%s"><checksum type="sha256">%s</checksum>'
+            '<open-checksum type="sha256">%s</open-checksum>'
+            '<location href="repodata/%s"/><timestamp>%d</timestamp>'
+            '<size>%d</size><open-size>%d</open-size></data>\n'
+            % (kind, checksum, open_checksum, name, now, size, open_size))
+    with open(os.path.join(repodata, 'repomd.xml'), 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<repomd xmlns="http://linux.duke.edu/metadata/repo" '
+                'xmlns:rpm="http://linux.duke.edu/metadata/rpm">\n'
+                '<revision>%d</revision>\n%s</repomd>\n' % (now, ''.join(data)))
+    return n
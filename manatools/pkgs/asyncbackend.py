@@ -0,0 +1,176 @@
+# vim: set fileencoding=utf-8 :
+# vim: set et ts=4 sw=4:
+'''
+ManaTools is a generic launcher application that can run
+internal or external modules, such as system configuration tools.
+
+ManaTools is also a collection of configuration tools that allows
+users to configure most of their system components in a very simple,
+intuitive and attractive interface. It consists of some modules
+that can be also run as autonomous applications.
+
+Python-ManaTools is a python framework to write manatools application
+written in python, this project started from perl manatools experience
+and its aim is to give an easy and common interface to develop and add
+new modules based on libYui. Every modules can be run using QT, Gtk or
+ncurses interface.
+
+License: LGPLv2+
+
+Author:  Angelo Naselli <anaselli@linux.it>
+
+@package manatools.pkgs.asyncbackend
+'''
+
+import asyncio
+import functools
+import concurrent.futures
+
+import manatools.pkgs.dnfbackend as dnfbackend
+
+
+class ReadWriteLock:
+    '''
+    asyncio lock allowing many readers or one writer at a time,
+    waiting writers are not starved by new readers
+    '''
+
+    def __init__(self):
+        self._cond = asyncio.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    async def acquire_read(self):
+        async with self._cond:
+            while self._writer or self._waiting_writers:
+                await self._cond.wait()
+            self._readers += 1
+
+    async def release_read(self):
+        async with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    async def acquire_write(self):
+        async with self._cond:
+            self._waiting_writers += 1
+            try:
+                while self._writer or self._readers:
+                    await self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+
+    async def release_write(self):
+        async with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class AsyncDnfBase:
+    '''
+    asyncio facade of DnfBase, blocking calls are run in a dedicated
+    executor. Sack or transaction changing operations are serialized,
+    read-only ones run concurrently.
+    '''
+
+    def __init__(self, max_workers=4, **kwargs):
+        '''
+        :param max_workers: executor threads
+        :param kwargs: DnfBase arguments (setup_sack, pbar, load_workers, ...)
+        '''
+        self._kwargs = kwargs
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._rwlock = None
+        self._load_lock = None
+        self.base = None
+
+    @property
+    def _lock(self):
+        # created in the running loop
+        if self._rwlock is None:
+            self._rwlock = ReadWriteLock()
+        return self._rwlock
+
+    async def run(self, func, *args, write=False, **kwargs):
+        '''
+        run func(*args, **kwargs) in the executor, write is True if func
+        changes the sack or the transaction
+        '''
+        loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs)
+        lock = self._lock
+        if write:
+            await lock.acquire_write()
+            try:
+                return await loop.run_in_executor(self._executor, call)
+            finally:
+                await lock.release_write()
+        await lock.acquire_read()
+        try:
+            return await loop.run_in_executor(self._executor, call)
+        finally:
+            await lock.release_read()
+
+    async def load(self):
+        '''
+        create the DnfBase, its sack is populated unless lazy=True was
+        given to the constructor, concurrent calls wait for the same base
+        '''
+        if self.base is None:
+            # created in the running loop
+            if self._load_lock is None:
+                self._load_lock = asyncio.Lock()
+            async with self._load_lock:
+                if self.base is None:
+                    self.base = await self.run(dnfbackend.DnfBase, write=True, **self._kwargs)
+        return self.base
+
+    async def search(self, fields, values, match_all=True, showdups=False, limit=None,
+                     use_index=False):
+        '''
+        DnfBase.search(), returns a list of package objects
+        '''
+        def _search():
+            return list(self.base.search(fields, values, match_all, showdups, limit, use_index))
+        return await self.run(_search)
+
+    async def resolve(self, allow_erasing=False):
+        '''
+        DnfBase.resolve()
+        '''
+        return await self.run(self.base.resolve, allow_erasing, write=True)
+
+    async def download(self, pkgs=None, progress=None, max_parallel=None):
+        '''
+        download and verify the given packages, or the transaction ones
+        '''
+        def _download():
+            to_dnl = pkgs if pkgs is not None else self.base.get_packages_to_download()
+            if to_dnl:
+                self.base.download_and_verify(to_dnl, progress, max_parallel)
+            return to_dnl
+        # it changes the download configuration and can import gpg keys
+        return await self.run(_download, write=True)
+
+    async def run_transaction(self, display=None):
+        '''
+        run the resolved transaction and refresh the sack
+        '''
+        def _run():
+            # no rpmdb watcher refresh while the transaction runs
+            with self.base.sack_lock:
+                rc = self.base.do_transaction(display) if display else self.base.do_transaction()
+                self.base.transaction_done()
+            return rc
+        return await self.run(_run, write=True)
+
+    def close(self):
+        '''
+        close the base and the executor
+        '''
+        if self.base is not None:
+            self.base.close()
+        self._executor.shutdown(wait=False)
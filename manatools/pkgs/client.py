@@ -0,0 +1,215 @@
+# vim: set fileencoding=utf-8 :
+# vim: set et ts=4 sw=4:
+'''
+ManaTools is a generic launcher application that can run
+internal or external modules, such as system configuration tools.
+
+ManaTools is also a collection of configuration tools that allows
+users to configure most of their system components in a very simple,
+intuitive and attractive interface. It consists of some modules
+that can be also run as autonomous applications.
+
+Python-ManaTools is a python framework to write manatools application
+written in python, this project started from perl manatools experience
+and its aim is to give an easy and common interface to develop and add
+new modules based on libYui. Every modules can be run using QT, Gtk or
+ncurses interface.
+
+License: LGPLv2+
+
+Author:  Angelo Naselli <anaselli@linux.it>
+
+@package manatools.pkgs.client
+'''
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+# NOTE client side of manatools.pkgs.daemon, it does not need dnf.
+# Functions have the manatools.pkgs.functions signatures, dnf_base is
+# the Connection returned by dnfBase() and packages are RemotePackage
+# objects.
+
+import os
+import json
+import socket
+import itertools
+
+''' serialized package attributes '''
+PACKAGE_FIELDS = ('name', 'epoch', 'version', 'release', 'arch', 'reponame', 'summary',
+                  'downloadsize', 'installsize', 'buildtime')
+
+
+def default_socket_path():
+    '''
+    return the daemon socket path, MANATOOLS_PKGS_SOCKET if set
+    '''
+    path = os.environ.get('MANATOOLS_PKGS_SOCKET')
+    if path:
+        return path
+    if os.geteuid() == 0 or not os.environ.get('XDG_RUNTIME_DIR'):
+        return '/run/manatools/pkgs.sock'
+    return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'manatools-pkgs.sock')
+
+
+class DaemonError(Exception):
+    '''
+    error raised by the daemon serving a call
+    '''
+    pass
+
+
+class RemotePackage:
+    '''
+    package as returned by the daemon, it has the PACKAGE_FIELDS attributes,
+    pkg_id (with the repo) and installed
+    '''
+
+    def __init__(self, data):
+        for field in PACKAGE_FIELDS:
+            setattr(self, field, data.get(field))
+        self.pkg_id = data['pkg_id']
+        self.installed = self.reponame == '@System'
+
+    def __eq__(self, other):
+        return isinstance(other, RemotePackage) and self.pkg_id == other.pkg_id
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.pkg_id)
+
+    def __str__(self):
+        if self.epoch and str(self.epoch) != '0':
+            return "%s-%s:%s-%s.%s" % (self.name, self.epoch, self.version, self.release, self.arch)
+        return "%s-%s-%s.%s" % (self.name, self.version, self.release, self.arch)
+
+    def __repr__(self):
+        return "<RemotePackage %s>" % self
+
+
+def encode(value, encode_package):
+    '''
+    return value as JSON serializable data, packages are given to encode_package()
+    '''
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, dict):
+        return {'__dict__': [[encode(k, encode_package), encode(v, encode_package)]
+                             for k, v in value.items()]}
+    if isinstance(value, tuple):
+        return {'__tuple__': [encode(v, encode_package) for v in value]}
+    if isinstance(value, (list, set, frozenset)):
+        return [encode(v, encode_package) for v in value]
+    try:
+        return encode_package(value)
+    except ValueError:
+        if not hasattr(value, '__iter__'):
+            raise
+    # views and other iterables
+    return [encode(v, encode_package) for v in value]
+
+def decode(value, decode_package):
+    '''
+    reverse of encode(), serialized packages are given to decode_package()
+    '''
+    if isinstance(value, list):
+        return [decode(v, decode_package) for v in value]
+    if isinstance(value, dict):
+        if '__tuple__' in value:
+            return tuple(decode(v, decode_package) for v in value['__tuple__'])
+        if '__dict__' in value:
+            return dict((decode(k, decode_package), decode(v, decode_package))
+                        for k, v in value['__dict__'])
+        if 'pkg_id' in value:
+            return decode_package(value)
+    return value
+
+def _encode_remote(pkg):
+    if not isinstance(pkg, RemotePackage):
+        raise ValueError
+    return {'pkg_id': pkg.pkg_id}
+
+
+class Connection:
+    '''
+    connection to the manatools.pkgs daemon, it has its own package queue
+    '''
+
+    def __init__(self, path=None):
+        self.path = path or default_socket_path()
+        self._ids = itertools.count(1)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(self.path)
+        self._file = self._sock.makefile('rwb')
+
+    def call(self, func, *args, **kwargs):
+        '''
+        run functions.func(base, *args, **kwargs) in the daemon
+        :raise DaemonError: if the daemon call failed
+        '''
+        request = {
+            'id'    : next(self._ids),
+            'func'  : func,
+            'args'  : encode(list(args), _encode_remote),
+            'kwargs': encode(kwargs, _encode_remote),
+        }
+        self._file.write(json.dumps(request).encode('utf-8') + b'\n')
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise DaemonError("connection closed by the daemon")
+        response = json.loads(line.decode('utf-8'))
+        if response.get('error'):
+            raise DaemonError(response['error'])
+        return decode(response.get('result'), RemotePackage)
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+
+def dnfBase(setup_sack=True, pbar=None, load_workers=1, repo_timeout=None, lazy=False,
+            path=None):
+    '''
+    returns a connection to the daemon, the sack is the daemon one so
+    arguments other than path are ignored
+    '''
+    return Connection(path)
+
+def selectedSize(dnf_base):
+    return dnf_base.call('selectedSize')
+
+def packagesProviding(dnf_base, name):
+    return dnf_base.call('packagesProviding', name)
+
+def packageByName(dnf_base, name):
+    return dnf_base.call('packageByName', name)
+
+def packagesByNames(dnf_base, names, provides=False):
+    return dnf_base.call('packagesByNames', names, provides)
+
+def packagesToInstall(dnf_base):
+    return dnf_base.call('packagesToInstall')
+
+def protected(dnf_base):
+    return dnf_base.call('protected')
+
+def is_protected(dnf_base, pkg):
+    return dnf_base.call('is_protected', pkg)
+
+def select_by_package_names(dnf_base, names, protected=False):
+    return dnf_base.call('select_by_package_names', names, protected)
+
+def select_by_package_names_or_die(dnf_base, names, protected=False):
+    return dnf_base.call('select_by_package_names_or_die', names, protected)
+
+def selectPackage(dnf_base, pkg, protected=False):
+    return dnf_base.call('selectPackage', pkg, protected)
+
+def unselectPackage(dnf_base, pkg):
+    return dnf_base.call('unselectPackage', pkg)
+
+def unselectAllPackages(dnf_base):
+    return dnf_base.call('unselectAllPackages')
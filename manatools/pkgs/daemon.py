@@ -0,0 +1,208 @@
+# vim: set fileencoding=utf-8 :
+# vim: set et ts=4 sw=4:
+'''
+ManaTools is a generic launcher application that can run
+internal or external modules, such as system configuration tools.
+
+ManaTools is also a collection of configuration tools that allows
+users to configure most of their system components in a very simple,
+intuitive and attractive interface. It consists of some modules
+that can be also run as autonomous applications.
+
+Python-ManaTools is a python framework to write manatools application
+written in python, this project started from perl manatools experience
+and its aim is to give an easy and common interface to develop and add
+new modules based on libYui. Every modules can be run using QT, Gtk or
+ncurses interface.
+
+License: LGPLv2+
+
+Author:  Angelo Naselli <anaselli@linux.it>
+
+@package manatools.pkgs.daemon
+'''
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import json
+import argparse
+import threading
+import socketserver
+
+import dnf.package
+
+import manatools.pkgs.packages as pkgs
+import manatools.pkgs.functions as functions
+import manatools.pkgs.snapshot as snapshot
+import manatools.pkgs.client as client
+
+''' manatools.pkgs.functions served by the daemon, functions changing the
+    shared sack (skip_packages) or taking objects that cannot be sent
+    (filter) are not '''
+SERVED_FUNCTIONS = ('selectedSize', 'packagesProviding', 'packageByName', 'packagesByNames',
+                    'packagesToInstall', 'protected', 'is_protected', 'select_by_package_names',
+                    'select_by_package_names_or_die', 'selectPackage', 'unselectPackage',
+                    'unselectAllPackages')
+
+
+def encode_package(pkg):
+    if not isinstance(pkg, dnf.package.Package):
+        raise ValueError
+    data = dict((field, getattr(pkg, field)) for field in client.PACKAGE_FIELDS)
+    data['pkg_id'] = str(pkgs.pkg_key(pkg, True))
+    return data
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    '''
+    one client connection, JSON requests and responses one per line
+    '''
+
+    def handle(self):
+        # every client has its own package queue
+        queue = pkgs.PackageQueue()
+        for line in self.rfile:
+            request_id = None
+            try:
+                request = json.loads(line.decode('utf-8'))
+                request_id = request.get('id')
+                result = self.server.daemon.call(queue, request['func'], request.get('args', []),
+                                                 request.get('kwargs', {}))
+                response = {'id': request_id, 'result': result}
+            except Exception as e:
+                response = {'id': request_id, 'error': "%s: %s" % (e.__class__.__name__, e)}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class PackageDaemon:
+    '''
+    Long-lived DnfBase serving manatools.pkgs.functions over a UNIX socket
+    (see manatools.pkgs.client). Calls are serialized, the sack and the
+    memoized Packages results are shared by all the clients, each client
+    has its own package queue (protected additions are shared).
+    The sack is filled again only when the rpmdb or the repository
+    metadata changed, checked every refresh_interval seconds.
+    '''
+
+    def __init__(self, path=None, base=None, refresh_interval=60, mode=0o660):
+        self.path = path or client.default_socket_path()
+        self.base = base
+        self.refresh_interval = refresh_interval
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._inputs = None
+        self._server = None
+
+    def _setup(self):
+        if self.base is None:
+            self.base = functions.dnfBase()
+        self.base.ensure_sack()
+        self._inputs = snapshot.SackSnapshot(self.base).inputs()
+
+    def refresh(self, force=False):
+        '''
+        fill the sack again if rpmdb or repository metadata changed,
+        returns True if the sack has been refreshed
+        '''
+        with self._lock:
+            base = self.base
+            # expired metadata are downloaded again here, if needed
+            base.load_repos()
+            inputs = snapshot.SackSnapshot(base).inputs()
+            if not force and inputs == self._inputs:
+                return False
+            # the installed index is updated in place
+            base.refresh_system()
+            self._inputs = inputs
+            return True
+
+    def _decode_package(self, data):
+        key = pkgs.PkgKey.from_string(data['pkg_id'])
+        found = self.base.packages.resolveKeys([key], self.base.sack.query())
+        if key not in found:
+            raise ValueError("package %s not found" % data['pkg_id'])
+        return found[key]
+
+    def call(self, queue, func, args, kwargs):
+        '''
+        run functions.func(base, *args, **kwargs) with the client queue,
+        returns the encoded result
+        '''
+        if func not in SERVED_FUNCTIONS:
+            raise ValueError("%s is not served" % func)
+        with self._lock:
+            base = self.base
+            args = client.decode(args, self._decode_package)
+            kwargs = client.decode(kwargs, self._decode_package)
+            queue.installed_index = base.packages.installed_index
+            saved = base.packageQueue
+            base.packageQueue = queue
+            try:
+                result = getattr(functions, func)(base, *args, **kwargs)
+                return client.encode(result, encode_package)
+            finally:
+                base.packageQueue = saved
+
+    def _refresher(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                # keep serving the old sack
+                print(e)
+
+    def serve_forever(self):
+        '''
+        load the sack and serve the clients until shutdown()
+        '''
+        self._setup()
+        d = os.path.dirname(self.path)
+        if d and not os.path.isdir(d):
+            os.makedirs(d)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = _Server(self.path, _Handler)
+        self._server.daemon = self
+        os.chmod(self.path, self.mode)
+        refresher = threading.Thread(target=self._refresher, name="pkgs-daemon-refresh")
+        refresher.daemon = True
+        refresher.start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._stop.set()
+            self._server.server_close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def shutdown(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='manatools.pkgs daemon')
+    parser.add_argument('--socket', help='socket path (default %s)' % client.default_socket_path())
+    parser.add_argument('--refresh', type=int, default=60, help='seconds between sack checks')
+    args = parser.parse_args(argv)
+    daemon = PackageDaemon(args.socket, refresh_interval=args.refresh)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -28,6 +28,9 @@ from __future__ import absolute_import
 from time import time
 from os import listdir
 import sys
+import queue
+import threading
+import concurrent.futures
 import dnf
 import dnf.yum
 import dnf.const
@@ -36,18 +39,75 @@ import dnf.subject
 import dnf.repodict
 import dnf.repo
 import dnf.package
+import dnf.exceptions
+import dnf.callback
+import dnf.drpm
+from dnf.callback import DownloadProgress
 import hawkey
 
 import gettext
 from gettext import gettext as _
 
 import manatools.pkgs.packages as pkgs
+import manatools.pkgs.progress as progress
+import manatools.pkgs.snapshot as snapshot
+import manatools.pkgs.search as search
+import manatools.pkgs.sharded as sharded
+import manatools.pkgs.download as download
+import manatools.pkgs.planner as planner
+import manatools.pkgs.watcher as watcher
+import manatools.pkgs.instrument as instrument
+
+''' sack population levels '''
+SACK_NONE = 0
+SACK_SYSTEM = 1
+SACK_FULL = 2
+
+class _VerifyingProgress(DownloadProgress):
+    '''
+    forward download callbacks to a progress bar, if any, and
+    hand every landed package to the verify callback as verify(pkg, checksum).
+    A delta rpm is handed over when the package has been rebuilt from it
+    (STATUS_DRPM, dnf has already checked its checksum), not when the
+    .drpm file has been downloaded
+    '''
+    def __init__(self, pbar, verify):
+        super(_VerifyingProgress, self).__init__()
+        self._pbar = pbar
+        self._verify = verify
+
+    def start(self, total_files, total_size, total_drpms=0):
+        # downloads run in batches, the progress bar is started
+        # once with the whole totals (see begin())
+        pass
+
+    def begin(self, total_files, total_size):
+        if self._pbar is not None:
+            self._pbar.start(total_files, total_size)
+
+    def progress(self, payload, done):
+        if self._pbar is not None:
+            self._pbar.progress(payload, done)
+
+    def end(self, payload, status, msg):
+        if self._pbar is not None:
+            self._pbar.end(payload, status, msg)
+        pkg = getattr(payload, 'pkg', None)
+        if pkg is None:
+            return
+        if isinstance(payload, dnf.drpm.DeltaPayload):
+            if status == dnf.callback.STATUS_DRPM:
+                self._verify(pkg, False)
+        elif status in (dnf.callback.STATUS_OK, dnf.callback.STATUS_ALREADY_EXISTS):
+            self._verify(pkg, True)
+
 
 class DnfBase(dnf.Base):
     '''
     class to encapsulate and extend the dnf.Base API
     '''
-    def __init__(self, setup_sack=True, pbar=None):
+    def __init__(self, setup_sack=True, pbar=None, load_workers=1, repo_timeout=None,
+                 lazy=False):
         dnf.Base.__init__(self)
         # setup the dnf cache
         RELEASEVER = dnf.rpm.detect_releasever(self.conf.installroot)
@@ -57,27 +117,271 @@ class DnfBase(dnf.Base):
         ## Package queue
         self.packageQueue = pkgs.PackageQueue()
 
+        ## repository metadata loading, repo id -> None or RepoError
+        self.load_workers = load_workers
+        self.repo_timeout = repo_timeout
+        self.repo_errors = {}
+
+        ## bumped every time the sack content changes
+        self.sack_generation = 0
+
+        ## sack population, lazy mode loads it on first use
+        self._pbar = pbar
+        self._sack_level = SACK_NONE
+        self._sack_lock = threading.RLock()
+        # notified when a repository metadata load is done
+        self._sack_loaded = threading.Condition(self._sack_lock)
+        self._loading_repos = False
+        self._preload_thread = None
+
+        ## search index, built on first use
+        self._search_index = None
+
+        ## process pool search, started on first use, None workers means a
+        ## process for each cpu
+        self.search_workers = None
+        self._sharded_search = None
+
+        ## dry-run planner, created on first use
+        self._planner = None
+
+        ## installed packages (added, removed) PkgKey lists of the last fill_sack()
+        self.installed_changes = ([], [])
+
+        ## gpg key import confirmation, called as dnf askcb
+        ## key_import_cb(pkg, userid, hexkeyid, keyurl, timestamp), without
+        ## it keys are imported only if conf.assumeyes is set. It is called
+        ## from the download_and_verify() verifier thread, GUIs have to
+        ## forward it to their main loop
+        self.key_import_cb = None
+
+        ## rpmdb cookie of the sack system repo, None if unknown
+        self.rpmdb_cookie = None
+        self._rpmdb_watcher = None
+
         # read the repository infomation
         self.read_all_repos()
         if setup_sack:
-            # populate the dnf sack
-            repos = self.repos.iter_enabled() #all()
+            self._packages = pkgs.Packages(self) # Define a Packages object
+            self.packageQueue.installed_index = self._packages.installed_index
+            if not lazy:
+                # populate the dnf sack
+                self.ensure_sack()
+
+    @instrument.traced()
+    def ensure_sack(self, available=True):
+        '''
+        populate the sack if not done yet
+        :param available: load also the enabled repositories (default),
+                          if False only installed packages are needed
+        '''
+        with self._sack_loaded:
+            if self._sack_level == SACK_FULL:
+                return
+            if not available:
+                # installed packages do not wait for a running metadata load
+                if self._sack_level == SACK_NONE:
+                    self.fill_sack(load_system_repo=True, load_available_repos=False)
+                    self._sack_level = SACK_SYSTEM
+                return
+            while self._loading_repos:
+                # the lock is released while waiting
+                self._sack_loaded.wait()
+            if self._sack_level == SACK_FULL:
+                return
+            self._loading_repos = True
+        try:
+            # metadata are loaded (downloaded) without holding the sack lock
+            for e in self.load_repos(self._pbar).values():
+                if e is not None:
+                    print(e)
+            with self._sack_lock:
+                # a new sack is created, system repo comes from the solv cache
+                self.fill_sack()
+                self._sack_level = SACK_FULL
+        finally:
+            with self._sack_loaded:
+                self._loading_repos = False
+                self._sack_loaded.notify_all()
+
+    @instrument.traced()
+    def fill_sack(self, *args, **kwargs):
+        '''
+        dnf.Base.fill_sack() that records a sack change, the installed
+        index is moved to the new sack packages (see installed_changes)
+        '''
+        rc = dnf.Base.fill_sack(self, *args, **kwargs)
+        self.sack_changed()
+        packages = getattr(self, '_packages', None)
+        if packages is not None:
+            system_loaded = kwargs.get('load_system_repo', args[0] if args else True)
+            self.installed_changes = packages.sack_replaced(bool(system_loaded))
+        return rc
+
+    def sack_changed(self):
+        '''
+        to be called after any change to the sack content (such as excludes),
+        memoized results of the old generation are discarded
+        '''
+        self.sack_generation += 1
+
+    def preload(self):
+        '''
+        populate the whole sack in background, the first access
+        needing it waits for the loading to finish
+        '''
+        if self._sack_level == SACK_FULL or self._preload_thread is not None:
+            return
+        self._preload_thread = threading.Thread(target=self.ensure_sack, name="dnf-sack-preload")
+        self._preload_thread.daemon = True
+        self._preload_thread.start()
+
+    @instrument.traced()
+    def load_repos(self, pbar=None, workers=None, timeout=None):
+        '''
+        load the metadata of all the enabled repositories
+        :param pbar: progress bar (dnf.callback.DownloadProgress) or None
+        :param workers: number of repositories loaded concurrently (default load_workers)
+        :param timeout: seconds to wait for each repository (default repo_timeout, None for ever),
+                        a timed out repository is disabled but its load cannot be
+                        cancelled, it goes on in a daemon thread. With a timeout
+                        repositories are loaded in threads even if workers is 1
+        :return: a dictionary repo id -> None if loaded or RepoError
+        '''
+        if workers is None:
+            workers = self.load_workers
+        if timeout is None:
+            timeout = self.repo_timeout
+
+        repos = list(self.repos.iter_enabled())
+        self.repo_errors = {}
+        if not repos:
+            return self.repo_errors
+
+        if (workers is None or workers <= 1) and not timeout:
             for repo in repos :
                 if pbar != None:
                     repo.set_progress_bar(pbar)
+                self.repo_errors[repo.id] = self._load_repo(repo)
+            return self.repo_errors
+
+        if pbar != None:
+            # callbacks are now coming from different threads
+            pbar = progress.SerializedProgress(pbar, len(repos))
+        started = {}
+        jobs = queue.Queue()
+        for repo in repos:
+            if pbar != None:
+                repo.set_progress_bar(pbar)
+            jobs.put(repo)
+        results = queue.Queue()
+
+        def worker():
+            while True:
                 try:
-                    repo.load()
-                except dnf.exceptions.RepoError as e:
-                    # TODO log and eventually manage it
-                    print(e)
+                    repo = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    results.put((repo, self._load_repo(repo, started), None))
+                except Exception as e:
+                    results.put((repo, None, e))
+
+        def start_worker():
+            # daemon threads, an abandoned load does not keep the process alive
+            t = threading.Thread(target=worker, name="dnf-repo-load")
+            t.daemon = True
+            t.start()
+
+        for i in range(min(max(1, workers or 1), len(repos))):
+            start_worker()
+        pending = dict((repo.id, repo) for repo in repos)
+        while pending:
+            try:
+                repo, error, exc = results.get(timeout=0.1 if timeout else None)
+            except queue.Empty:
+                repo = None
+            if repo is not None and repo.id in pending:
+                if exc is not None:
+                    raise exc
+                del pending[repo.id]
+                self.repo_errors[repo.id] = error
+            if not timeout:
+                continue
+            now = time()
+            for repo in list(pending.values()):
+                if repo.id in started and now - started[repo.id] > timeout:
+                    # a running load cannot be interrupted, leave it behind
+                    # and do not let fill_sack() wait for it again, another
+                    # worker takes the remaining repositories
+                    del pending[repo.id]
+                    repo.disable()
+                    self.repo_errors[repo.id] = dnf.exceptions.RepoError(
+                        _("Timeout loading repository %s (%d seconds)") % (repo.id, timeout))
+                    if not jobs.empty():
+                        start_worker()
 
-                #repo.set_progress_bar(None)
+        return self.repo_errors
+
+    def _load_repo(self, repo, started=None):
+        '''
+        load the given repo metadata, returns None or the RepoError raised
+        '''
+        if started is not None:
+            started[repo.id] = time()
+        try:
+            with instrument.span('dnfbackend.repo_load', repo=repo.id):
+                repo.load()
+        except dnf.exceptions.RepoError as e:
+            # TODO log and eventually manage it
+            return e
+        return None
+
+    @instrument.traced()
+    def setup_base(self):
+        with self._sack_lock:
             self.fill_sack()
+            self._sack_level = SACK_FULL
+        if getattr(self, '_packages', None) is None:
             self._packages = pkgs.Packages(self) # Define a Packages object
+            self.packageQueue.installed_index = self._packages.installed_index
 
-    def setup_base(self):
-        self.fill_sack()
-        self._packages = pkgs.Packages(self) # Define a Packages object
+    @instrument.traced()
+    def refresh_system(self):
+        '''
+        fill the sack again after an rpmdb change and update the installed
+        index in place. hawkey cannot replace the system repo of a sack, so
+        a new one is filled, the loaded repositories come from their solv
+        caches and nothing is downloaded
+        :return: a tuple (added PkgKey list, removed PkgKey list)
+        '''
+        with self._sack_lock:
+            available = self._sack_level == SACK_FULL
+            self.fill_sack(load_system_repo=True, load_available_repos=available)
+            if not available:
+                self._sack_level = SACK_SYSTEM
+            self.rpmdb_cookie = snapshot.rpmdb_cookie(self.conf.installroot)
+        # fill_sack() updated the installed index
+        return self.installed_changes
+
+    def watch_rpmdb(self, interval=2.0, callback=None):
+        '''
+        refresh the sack in background when the rpmdb is changed by other
+        tools (see watcher.RpmdbWatcher), returns the watcher.
+        The sack, the memoized Packages results and the installed index are
+        replaced in the watcher thread holding sack_lock, other threads
+        using the base while it is watched must hold sack_lock too
+        '''
+        if self._rpmdb_watcher is None:
+            self.ensure_sack(False)
+            self._rpmdb_watcher = watcher.RpmdbWatcher(self, interval, callback=callback)
+            self._rpmdb_watcher.start()
+        return self._rpmdb_watcher
+
+    @property
+    def sack_lock(self):
+        ''' reentrant lock held while the sack is filled or replaced '''
+        return self._sack_lock
 
     @property
     def packages(self):
@@ -100,15 +404,49 @@ class DnfBase(dnf.Base):
         print(_("cachedir: %s") % conf.cachedir)
 
 
-    def search(self, fields, values, match_all=True, showdups=False):
+    @property
+    def search_index(self):
+        '''
+        the search index of the current sack, built (or loaded from
+        the cache) on first use and again when the sack changes
+        '''
+        self.ensure_sack()
+        index = self._search_index
+        if index is None or index.generation != self.sack_generation:
+            index = search.SearchIndex.load_or_build(self)
+            self._search_index = index
+        return index
+
+    @property
+    def sharded_search(self):
+        '''
+        the process pool search engine (see sharded.ShardedSearch)
+        '''
+        self.ensure_sack()
+        if self._sharded_search is None:
+            self._sharded_search = sharded.ShardedSearch(self, self.search_workers)
+        return self._sharded_search
+
+    @instrument.traced()
+    def search(self, fields, values, match_all=True, showdups=False, limit=None, use_index=False,
+               use_shards=False):
         '''
         search in a list of package fields for a list of keys
         :param fields: package attributes to search in
         :param values: the values to match
         :param match_all: match all values (default)
         :param showdups: show duplicate packages or latest (default)
+        :param limit: max number of packages returned (default all)
+        :param use_index: use the search index, results are ranked
+        :param use_shards: scan the sack in a process pool
         :return: a list of package objects
         '''
+        self.ensure_sack()
+        if use_index:
+            return self.search_index.search(fields, values, match_all, showdups, limit)
+        if use_shards:
+            return self.sharded_search.search(fields, values, match_all, showdups, limit)
+
         matches = set()
         for key in values:
             key_set = set()
@@ -125,9 +463,30 @@ class DnfBase(dnf.Base):
         result = list(matches)
         if not showdups:
             result = self.sack.query().filter(pkg=result).latest()
+        if limit is not None:
+            result = list(result)[:limit]
         return result
 
+    def close(self):
+        '''
+        dnf.Base.close() stopping the search workers and the rpmdb watcher too
+        '''
+        if getattr(self, '_sharded_search', None) is not None:
+            self._sharded_search.close()
+            self._sharded_search = None
+        if getattr(self, '_rpmdb_watcher', None) is not None:
+            self._rpmdb_watcher.stop()
+            self._rpmdb_watcher = None
+        dnf.Base.close(self)
+
+    def search_session(self, fields, match_all=True, showdups=False):
+        '''
+        returns a search-as-you-type session (see search.SearchSession)
+        '''
+        return search.SearchSession(self, fields, match_all, showdups)
+
     def contains(self, attr, needle, ignore_case=True):
+        self.ensure_sack()
         fdict = {'%s__substr' % attr : needle}
         if ignore_case:
             return self.sack.query().filter(hawkey.ICASE, **fdict)
@@ -135,28 +494,152 @@ class DnfBase(dnf.Base):
             return self.sack.query().filter(**fdict)
 
 
-    def apply_transaction(self):
-        rc = self.resolve()
-        print(_("Depsolve rc: "), rc)
-        if rc:
-            progress = progress_ui.Progress()
-            to_dnl = self.get_packages_to_download()
-            if len(to_dnl) :
-                # Downloading Packages
-                self.download_packages(to_dnl, progress)
-
-            print(_("\nRunning Transaction"))
-            print(self.do_transaction())
-#            display = progress_ui.TransactionProgress()
-#            s = self.do_transaction(display)
-#            if isinstance(s, str):
-#                print(s)
-            del progress
-#            del display
-            self.setup_base()
+    def apply_transaction(self, pbar=None, max_parallel=None):
+        '''
+        resolve, download and verify the packages and run the transaction
+        :param pbar: download progress bar (default progress.Progress)
+        :param max_parallel: number of parallel downloads (default dnf configuration)
+        '''
+        # the rpmdb watcher must not fill the sack again, resetting the goal
+        # and the transaction, while the transaction is resolved and run
+        with self._sack_lock:
+            with instrument.span('dnfbackend.resolve'):
+                rc = self.resolve()
+            print(_("Depsolve rc: "), rc)
+            if rc:
+                if pbar is None:
+                    pbar = progress.Progress()
+                to_dnl = self.get_packages_to_download()
+                if len(to_dnl) :
+                    # Downloading and verifying Packages
+                    self.download_and_verify(to_dnl, pbar, max_parallel)
+
+                print(_("\nRunning Transaction"))
+                with instrument.span('dnfbackend.do_transaction'):
+                    print(self.do_transaction())
+#                display = progress_ui.TransactionProgress()
+#                s = self.do_transaction(display)
+#                if isinstance(s, str):
+#                    print(s)
+#                del display
+                self.transaction_done()
+
+            else:
+                print(_("Depsolve failed"))
 
-        else:
-            print(_("Depsolve failed"))
+    @instrument.traced()
+    def verify_package(self, pkg, checksum=True):
+        '''
+        check checksum and signature of a downloaded package
+        :param checksum: False if the checksum has already been verified
+        :return: None if good or the error message
+        '''
+        if checksum and not pkg.verifyLocalPkg():
+            return _("%s: checksum mismatch") % pkg.localPkg()
+        result, err = self.package_signature_check(pkg)
+        if result == 1:
+            # the repository key is not imported yet, same as dnf
+            try:
+                self._get_key_for_package(pkg, self.key_import_cb)
+            except dnf.exceptions.Error as e:
+                return str(e)
+            result, err = self.package_signature_check(pkg)
+        if result != 0:
+            return err or (_("%s: signature check failed") % pkg.localPkg())
+        return None
+
+    @instrument.traced()
+    def download_and_verify(self, pkgs, pbar=None, max_parallel=None, batch_size=None):
+        '''
+        download pkgs verifying each one as soon as it lands, a verification
+        failure stops the download before the next batch of packages.
+        Packages are verified in a separate thread, missing gpg keys are
+        imported there too (see key_import_cb)
+        :param pkgs: packages to download
+        :param pbar: progress bar (dnf.callback.DownloadProgress) or None
+        :param max_parallel: number of parallel downloads (default dnf configuration)
+        :param batch_size: packages per download batch (default 4 * max_parallel)
+        :raise dnf.exceptions.Error: if some package is corrupted or not signed
+        '''
+        saved_parallel = self.conf.max_parallel_downloads
+        if max_parallel:
+            self.conf.max_parallel_downloads = max_parallel
+        if not batch_size:
+            batch_size = max(1, 4 * self.conf.max_parallel_downloads)
+
+        # rpm signature checks are not thread safe, one verifier is enough
+        # to keep up with downloads
+        verifier = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        verifying = []
+        errors = []
+        def verify(pkg, checksum=True):
+            verifying.append((pkg, verifier.submit(self.verify_package, pkg, checksum)))
+        def collect(wait):
+            pending = []
+            for pkg, future in verifying:
+                if not wait and not future.done():
+                    pending.append((pkg, future))
+                elif future.result():
+                    errors.append(future.result())
+            verifying[:] = pending
+        vbar = _VerifyingProgress(pbar, verify)
+        try:
+            # cached packages with a good checksum are only signature checked,
+            # corrupted ones are downloaded again
+            plan = download.plan(self, pkgs, verify=True)
+            for pkg in plan.packages(download.CACHED):
+                verify(pkg, download.is_local(pkg))
+            to_dnl = plan.to_download()
+            vbar.begin(len(to_dnl), plan.download_size)
+            for i in range(0, len(to_dnl), batch_size):
+                self.download_packages(to_dnl[i:i+batch_size], vbar)
+                collect(False)
+                if errors:
+                    break
+            if not errors:
+                collect(True)
+        finally:
+            verifier.shutdown(wait=not errors)
+            self.conf.max_parallel_downloads = saved_parallel
+
+        if errors:
+            raise dnf.exceptions.Error("\n".join(errors))
+
+    def download_plan(self, pkgs=None):
+        '''
+        return the download.DownloadPlan of pkgs, or of the transaction
+        packages, telling which packages are cached, delta or full downloads
+        '''
+        if pkgs is None:
+            pkgs = self.get_packages_to_download()
+        return download.plan(self, pkgs)
+
+    @property
+    def planner(self):
+        '''
+        the planner.DryRunPlanner of the package queue
+        '''
+        if self._planner is None:
+            self._planner = planner.DryRunPlanner(self)
+        return self._planner
+
+    def dry_run(self, allow_erasing=False):
+        '''
+        return the planner.TransactionPlan of the package queue, depsolve
+        results are memoized, base transaction is not changed.
+        allow_erasing as in resolve()
+        '''
+        return self.planner.plan(allow_erasing)
+
+    @instrument.traced()
+    def transaction_done(self):
+        '''
+        update installed packages and the sack after do_transaction().
+        hawkey cannot replace the system repo of a sack, a new sack is
+        filled (see refresh_system()), it costs about as much as the sack
+        load of setup_base(), only the installed index is updated in place
+        '''
+        self.refresh_system()
 
     def get_packages_to_download(self):
         to_dnl = []
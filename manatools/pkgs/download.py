@@ -0,0 +1,135 @@
+# vim: set fileencoding=utf-8 :
+# vim: set et ts=4 sw=4:
+'''
+ManaTools is a generic launcher application that can run
+internal or external modules, such as system configuration tools.
+
+ManaTools is also a collection of configuration tools that allows
+users to configure most of their system components in a very simple,
+intuitive and attractive interface. It consists of some modules
+that can be also run as autonomous applications.
+
+Python-ManaTools is a python framework to write manatools application
+written in python, this project started from perl manatools experience
+and its aim is to give an easy and common interface to develop and add
+new modules based on libYui. Every modules can be run using QT, Gtk or
+ncurses interface.
+
+License: LGPLv2+
+
+Author:  Angelo Naselli <anaselli@linux.it>
+
+@package manatools.pkgs.download
+'''
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import dnf
+import dnf.drpm
+import manatools.pkgs.instrument as instrument
+
+''' download plan entry kinds '''
+CACHED = 'cached'
+DELTA = 'delta'
+FULL = 'full'
+
+
+class DownloadPlan:
+    '''
+    What has really to be fetched for a set of packages, each package is
+    classified as cached (already in the local cache or in a local repo),
+    delta (a delta rpm is available) or full download
+    '''
+
+    def __init__(self):
+        self.entries = []
+        self.download_size = 0
+        self.full_size = 0
+
+    def add(self, pkg, kind, size):
+        self.entries.append((pkg, kind, size))
+        self.download_size += size
+        self.full_size += pkg.downloadsize
+
+    def packages(self, kind=None):
+        '''
+        return the packages of the given kind, or all of them
+        '''
+        return [pkg for pkg, k, size in self.entries if kind is None or k == kind]
+
+    def to_download(self):
+        '''
+        return the packages that have to be fetched (delta or full)
+        '''
+        return [pkg for pkg, k, size in self.entries if k != CACHED]
+
+    def summary(self):
+        '''
+        return a dictionary kind -> (number of packages, bytes to fetch)
+        '''
+        result = {CACHED: (0, 0), DELTA: (0, 0), FULL: (0, 0)}
+        for pkg, kind, size in self.entries:
+            num, total = result[kind]
+            result[kind] = (num + 1, total + size)
+        return result
+
+
+def is_local(pkg):
+    '''
+    return if pkg comes from a local repository
+    '''
+    try:
+        return bool(pkg.repo.local)
+    except AttributeError:
+        return False
+
+def is_cached(pkg, verify=False):
+    '''
+    return if pkg does not need to be downloaded
+    :param verify: check the checksum of the cached file, the size is
+                   compared otherwise (a corrupted file would be counted).
+                   Packages of local repositories are never checked
+    '''
+    if is_local(pkg):
+        return True
+    path = pkg.localPkg()
+    try:
+        if os.path.getsize(path) != pkg.downloadsize:
+            return False
+    except OSError:
+        return False
+    return not verify or pkg.verifyLocalPkg()
+
+def _delta_info(base, progress):
+    conf = base.conf
+    if not getattr(conf, 'deltarpm', False):
+        return None
+    try:
+        return dnf.drpm.DeltaInfo(base.sack.query().installed(), progress,
+                                  conf.deltarpm_percentage)
+    except Exception:
+        # deltarpm not available
+        return None
+
+@instrument.traced()
+def plan(base, pkgs, progress=None, verify=False):
+    '''
+    return the DownloadPlan of the given packages
+    :param verify: cached packages are checksum verified (see is_cached)
+    '''
+    result = DownloadPlan()
+    delta_info = None
+    for pkg in pkgs:
+        if is_cached(pkg, verify):
+            result.add(pkg, CACHED, 0)
+            continue
+        if delta_info is None:
+            delta_info = _delta_info(base, progress) or False
+        payload = delta_info.delta_factory(pkg, progress) if delta_info else None
+        if payload is not None:
+            result.add(pkg, DELTA, payload.download_size)
+        else:
+            result.add(pkg, FULL, pkg.downloadsize)
+    return result
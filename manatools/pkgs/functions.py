@@ -25,29 +25,55 @@ import dnf
 import dnf.package
 
 import manatools.pkgs.dnfbackend as dnfbackend
+import manatools.pkgs.download as download
+import manatools.pkgs.instrument as instrument
 
-def dnfBase(setup_sack=True, pbar=None):
+def dnfBase(setup_sack=True, pbar=None, load_workers=1, repo_timeout=None, lazy=False):
   '''
-  returns a dnf base object
+  returns a dnf base object, repository metadata are loaded by
+  load_workers threads waiting repo_timeout seconds at most for each one.
+  If lazy is True the sack is populated on first use, only with the
+  installed packages if nothing else is needed
   '''
-  return dnfbackend.DnfBase(setup_sack, pbar)
+  return dnfbackend.DnfBase(setup_sack, pbar, load_workers, repo_timeout, lazy)
 
 def selectedSize(dnf_base):
     '''
-      return the transaction download size if a transaction has been run,
-      or the action queue content size otherwise
+      return the bytes to be downloaded for the transaction if it has been run,
+      or for the action queue content otherwise. Packages already in the
+      local cache are not counted and delta rpms are counted instead of
+      full packages if available (see downloadPlan)
+    '''
+    if not isinstance(dnf_base, dnfbackend.DnfBase):
+        raise ValueError
+
+    return downloadPlan(dnf_base).download_size
+
+def downloadPlan(dnf_base):
+    '''
+      return the download plan (manatools.pkgs.download.DownloadPlan) of
+      the transaction if it has been run, or of the action queue otherwise
     '''
     if not isinstance(dnf_base, dnfbackend.DnfBase):
         raise ValueError
 
-    total_size = 0
     if dnf_base.transaction:
-        for tsi in dnf_base.transaction:
-            if tsi.installed:
-                total_size += tsi.installed.downloadsize
-    else:
-      total_size = dnf_base.packageQueue.downloadsize()
-    return total_size
+        return dnf_base.download_plan(packagesToInstall(dnf_base))
+    if not dnf_base.packageQueue.total():
+        return download.DownloadPlan()
+    # memoized by queue content and sack generation
+    return dnf_base.planner.download()
+
+def transactionPlan(dnf_base):
+    '''
+      return what would happen running the action queue content, as a
+      manatools.pkgs.planner.TransactionPlan (installs, removes, sizes...)
+      without changing the base transaction
+    '''
+    if not isinstance(dnf_base, dnfbackend.DnfBase):
+        raise ValueError
+
+    return dnf_base.dry_run()
 
 def packagesProviding(dnf_base, name):
     '''
@@ -56,7 +82,6 @@ def packagesProviding(dnf_base, name):
     if not isinstance(dnf_base, dnfbackend.DnfBase):
         raise ValueError
 
-    dnf_base.packages.all
     q = dnf_base.packages.query
     i = q.filter(provides=name,latest=True)
 
@@ -70,7 +95,6 @@ def packageByName(dnf_base, name):
     if not isinstance(dnf_base, dnfbackend.DnfBase):
         raise ValueError
 
-    dnf_base.packages.all
     q = dnf_base.packages.query
     i = q.filter(name=name,latest=True)
     p = i.run()
@@ -79,6 +103,19 @@ def packageByName(dnf_base, name):
 
     return None
 
+@instrument.traced()
+def packagesByNames(dnf_base, names, provides=False):
+    '''
+    search packages with given "names" at once, it takes the most up-to-date
+    ones, if provides is True names are also looked for as provides.
+    Returns a tuple (dictionary name -> package, list of names not found)
+    '''
+    if not isinstance(dnf_base, dnfbackend.DnfBase):
+        raise ValueError
+
+    return dnf_base.packages.resolveNames(names, provides)
+
+@instrument.traced()
 def packagesToInstall(dnf_base):
     '''
     return the package list to be installed from transaction
@@ -92,17 +129,15 @@ def packagesToInstall(dnf_base):
         if tsi.installed:
           to_dnl.append(tsi.installed)
     else:
-      il = dnf_base.packageQueue.install_list()
       #NOTE adding also updates by now
       #TODO check if correct
-      il.extend(dnf_base.packageQueue.update_list())
-      q = dnf_base.sack.query()
-      f = q.available()
+      queue = dnf_base.packageQueue
+      il = queue.install_list() + queue.update_list() + queue.reinstall_list()
+      # all the queued packages at once
+      found = dnf_base.packages.resolveKeys(il)
       for pid in il:
-        (n, e, v, r, a, repo_id) = pid.split(',')
-        pl = f.filter(name=n, version=v, release=r, arch=a)
-        if len(pl) > 0:
-          to_dnl.append(pl[0])
+        if pid in found:
+          to_dnl.append(found[pid])
 
     return to_dnl
 
@@ -114,6 +149,7 @@ def filter(query, options):
         raise ValueError
     return query.filter(**options)
 
+@instrument.traced()
 def skip_packages(dnf_base, skipped_packages):
     '''
     excludes skipped_packages (array of pcakages names)
@@ -121,12 +157,14 @@ def skip_packages(dnf_base, skipped_packages):
     if not isinstance(dnf_base, dnfbackend.DnfBase):
         raise ValueError
 
+    dnf_base.ensure_sack()
     for pkg_name in skipped_packages:
         subj = dnf.subject.Subject(pkg_name)
         pkgs = subj.get_best_query(dnf_base.sack)
         # The only way to get expected behavior is to declare it
         # as excluded from the installable set
         dnf_base.sack.add_excludes(pkgs)
+    dnf_base.sack_changed()
 
 def protected(dnf_base):
     '''
@@ -145,6 +183,7 @@ def is_protected(dnf_base, pkg):
         raise ValueError
     return dnf_base.packages.isProtected(pkg)
 
+@instrument.traced()
 def select_by_package_names(dnf_base, names, protected=False):
     '''
     select packages to install by providing their names and
@@ -153,13 +192,15 @@ def select_by_package_names(dnf_base, names, protected=False):
     if not isinstance(dnf_base, dnfbackend.DnfBase):
         raise ValueError
 
+    found, missing = packagesByNames(dnf_base, names)
     for name in names:
-      p = packageByName(dnf_base, name)
+      p = found.get(name)
       if p:
         dnf_base.packageQueue.add_to_install(p)
         if protected:
           dnf_base.packages.addToProtected(p)
     #TODO manage return package list (transaction)
+    return missing
 
 def select_by_package_names_or_die(dnf_base, names, protected=False):
     '''
@@ -203,6 +244,5 @@ def unselectAllPackages(dnf_base) :
     if not isinstance(dnf_base, dnfbackend.DnfBase):
         raise ValueError
 
-    for p in packagesToInstall(dnf_base):
-        if not is_protected(dnf_base, p):
-            dnf_base.packageQueue.remove(p)
+    to_remove = [p for p in packagesToInstall(dnf_base) if not is_protected(dnf_base, p)]
+    dnf_base.packageQueue.remove_many(to_remove)
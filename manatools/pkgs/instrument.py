@@ -0,0 +1,224 @@
+# vim: set fileencoding=utf-8 :
+# vim: set et ts=4 sw=4:
+'''
+ManaTools is a generic launcher application that can run
+internal or external modules, such as system configuration tools.
+
+ManaTools is also a collection of configuration tools that allows
+users to configure most of their system components in a very simple,
+intuitive and attractive interface. It consists of some modules
+that can be also run as autonomous applications.
+
+Python-ManaTools is a python framework to write manatools application
+written in python, this project started from perl manatools experience
+and its aim is to give an easy and common interface to develop and add
+new modules based on libYui. Every modules can be run using QT, Gtk or
+ncurses interface.
+
+License: LGPLv2+
+
+Author:  Angelo Naselli <anaselli@linux.it>
+
+@package manatools.pkgs.instrument
+'''
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import json
+import atexit
+import functools
+import threading
+import collections
+from time import perf_counter
+
+''' environment variable enabling tracing at import, if it is not "1" it is
+    also the chrome trace file written at exit '''
+TRACE_ENV = 'MANATOOLS_PKGS_TRACE'
+
+
+class _NoSpan:
+    '''
+    shared span used while tracing is disabled
+    '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    def __init__(self, tracer, name, args):
+        self._tracer = tracer
+        self._name = name
+        self._args = args
+        self._start = 0
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._tracer.record(self._name, self._start, perf_counter() - self._start, self._args)
+        return False
+
+
+class Tracer:
+    '''
+    Collects timing spans: per name statistics (count, total, min, max)
+    and the last max_events events for traces
+    '''
+
+    def __init__(self, max_events=100000):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._epoch = perf_counter()
+        self._stats = {}
+        self._events = collections.deque(maxlen=max_events)
+
+    def reset(self):
+        with self._lock:
+            self._epoch = perf_counter()
+            self._stats = {}
+            self._events.clear()
+
+    def span(self, name, **args):
+        '''
+        return a context manager timing its block as name, args are
+        stored in the trace events
+        '''
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self, name, args)
+
+    def record(self, name, start, duration, args=None):
+        with self._lock:
+            stat = self._stats.get(name)
+            if stat is None:
+                self._stats[name] = [1, duration, duration, duration]
+            else:
+                stat[0] += 1
+                stat[1] += duration
+                if duration < stat[2]:
+                    stat[2] = duration
+                if duration > stat[3]:
+                    stat[3] = duration
+            self._events.append((name, start, duration, threading.get_ident(), args))
+
+    def stats(self):
+        '''
+        return a dictionary name -> {count, total, min, max, mean} (seconds)
+        '''
+        with self._lock:
+            return {name: {'count': c, 'total': t, 'min': lo, 'max': hi, 'mean': t / c}
+                    for name, (c, t, lo, hi) in self._stats.items()}
+
+    def summary(self):
+        '''
+        return the statistics as a text table, slowest operations first
+        '''
+        stats = self.stats()
+        lines = ["%-40s %8s %12s %12s %12s" % ("operation", "count", "total ms", "mean ms", "max ms")]
+        for name, s in sorted(stats.items(), key=lambda item: -item[1]['total']):
+            lines.append("%-40s %8d %12.3f %12.3f %12.3f" %
+                         (name, s['count'], s['total'] * 1000, s['mean'] * 1000, s['max'] * 1000))
+        return "\n".join(lines)
+
+    def events(self):
+        '''
+        return the recorded events as dictionaries, times in seconds
+        from the tracer start (or reset)
+        '''
+        with self._lock:
+            events = list(self._events)
+            epoch = self._epoch
+        return [{'name': name, 'start': start - epoch, 'duration': duration,
+                 'thread': tid, 'args': args or {}}
+                for name, start, duration, tid, args in events]
+
+    def save_json(self, path):
+        '''
+        write statistics and events as JSON
+        '''
+        with open(path, 'w') as f:
+            json.dump({'stats': self.stats(), 'events': self.events()}, f, indent=1, default=str)
+
+    def save_chrome_trace(self, path):
+        '''
+        write the events in the Chrome trace event format (chrome://tracing,
+        perfetto)
+        '''
+        pid = os.getpid()
+        trace = [{'name': e['name'], 'cat': e['name'].split('.', 1)[0], 'ph': 'X',
+                  'ts': e['start'] * 1e6, 'dur': e['duration'] * 1e6,
+                  'pid': pid, 'tid': e['thread'], 'args': e['args']}
+                 for e in self.events()]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f, default=str)
+
+
+''' default tracer used by manatools.pkgs '''
+tracer = Tracer()
+
+def enable():
+    tracer.enabled = True
+
+def disable():
+    tracer.enabled = False
+
+def is_enabled():
+    return tracer.enabled
+
+def reset():
+    tracer.reset()
+
+def span(name, **args):
+    '''
+    time a block, e.g.
+        with instrument.span('packages.protected', names=len(names)):
+            ...
+    '''
+    return tracer.span(name, **args)
+
+def traced(name=None):
+    '''
+    decorator timing every call of the function as name (default
+    module.qualified name), the tracing state is checked at call time
+    '''
+    def decorator(func):
+        span_name = name or "%s.%s" % (func.__module__.rsplit('.', 1)[-1], func.__qualname__)
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                tracer.record(span_name, start, perf_counter() - start)
+        return wrapper
+    return decorator
+
+def summary():
+    return tracer.summary()
+
+def save_json(path):
+    tracer.save_json(path)
+
+def save_chrome_trace(path):
+    tracer.save_chrome_trace(path)
+
+
+def _setup_from_env():
+    value = os.environ.get(TRACE_ENV)
+    if not value or value == '0':
+        return
+    enable()
+    if value != '1':
+        atexit.register(save_chrome_trace, value)
+
+_setup_from_env()
@@ -27,7 +27,16 @@ from __future__ import absolute_import
 
 from time import time
 from os import listdir
+import os
 import sys
+import json
+import csv
+import struct
+import operator
+import bisect
+import collections
+import itertools
+from array import array
 import dnf
 import dnf.yum
 import dnf.const
@@ -41,6 +50,22 @@ import hawkey
 import gettext
 from gettext import gettext as _
 
+import manatools.pkgs.snapshot as snapshot
+import manatools.pkgs.instrument as instrument
+
+''' dnf protected packages configuration '''
+PROTECTED_CONF_PATH = '/etc/dnf/protected.d'
+''' persisted protected packages '''
+PROTECTED_CACHE = 'protected.json'
+''' exportable package fields (see export_columns), the integer ones are
+    exported as int64 arrays '''
+EXPORT_FIELDS = ('name', 'epoch', 'version', 'release', 'arch', 'reponame',
+                 'size', 'downloadsize', 'installsize', 'buildtime', 'installtime', 'license')
+EXPORT_INT_FIELDS = frozenset(('epoch', 'size', 'downloadsize', 'installsize', 'buildtime', 'installtime'))
+''' binary export header: magic, format version, rows, fields '''
+EXPORT_MAGIC = b'MTPK'
+EXPORT_FORMAT = 1
+
 class Packages:
     '''
     Get access to packages in the dnf (hawkey) sack in an easy way
@@ -48,26 +73,120 @@ class Packages:
 
     def __init__(self, base):
         self._base = base
-        self._sack = base.sack
-        self._inst_na = self._sack.query().installed()._na_dict()
         self._protected = None
+        # protected packages requirements are protected too if True
+        self.protected_recursive = False
+        self._required_seen = set()
+        # installed packages, kept up to date by transactions
+        self.installed_index = InstalledIndex(lambda: self._query(False).installed())
+        # memoized results, valid for one sack generation
+        self._cache = {}
+        self._cache_generation = None
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+    @property
+    def _sack(self):
+        '''
+        the current base sack (it could be populated lazily)
+        '''
+        return self._base.sack
+
+    def _query(self, available=True):
+        '''
+        get a query object making sure the needed part of the sack is loaded
+        :param available: False if only installed packages are queried
+        '''
+        self._base.ensure_sack(available)
+        return self._sack.query()
+
+    def _cached(self, key, build, available=True):
+        '''
+        return the memoized result for key, build() is called to compute it
+        if it is missing or the sack changed (see DnfBase.sack_generation)
+        '''
+        self._base.ensure_sack(available)
+        generation = self._base.sack_generation
+        if self._cache_generation != generation:
+            self._cache = {}
+            self._cache_generation = generation
+        try:
+            value = self._cache[key]
+            self._cache_hits += 1
+        except KeyError:
+            self._cache_misses += 1
+            if instrument.is_enabled():
+                # the key is formatted only when tracing
+                with instrument.span('packages.build', key=str(key)):
+                    value = build()
+            else:
+                value = build()
+            self._cache[key] = value
+        return value
+
+    def invalidate(self):
+        '''
+        drop all the memoized results
+        '''
+        self._cache = {}
+        self._cache_generation = None
+
+    def cache_stats(self):
+        '''
+        return memoized results statistics as a dictionary
+        '''
+        return {
+            'hits'      : self._cache_hits,
+            'misses'    : self._cache_misses,
+            'entries'   : len(self._cache),
+            'generation': self._cache_generation,
+        }
 
+    def refresh(self):
+        '''
+        drop memoized results and protected packages after the sack has been
+        filled again, the installed index is kept
+        '''
+        self.invalidate()
+        self._protected = None
+        self._required_seen = set()
+
+    def sack_replaced(self, system_loaded=True):
+        '''
+        to be called when a new sack has been filled, the installed index
+        (if built) gets the package objects of the new sack, memoized
+        results and protected packages are dropped
+        :param system_loaded: the new sack has the installed packages
+        :return: a tuple (added PkgKey list, removed PkgKey list)
+        '''
+        changes = ([], [])
+        index = self.installed_index
+        if system_loaded and index.is_built():
+            changes = index.sync(self._sack.query().installed().run())
+        self.refresh()
+        return changes
+
+    @instrument.traced()
     def _filter_packages(self, pkg_list, replace=True):
         '''
         Filter a list of package objects and replace
         the installed ones with the installed object, instead
         of the available object
         '''
-        pkgs = []
-        for pkg in pkg_list:
-            key = (pkg.name, pkg.arch)
-            inst_pkg = self._inst_na.get(key, [None])[0]
-            if inst_pkg and inst_pkg.evr == pkg.evr:
+        return list(self._iter_filter_packages(pkg_list, replace))
+
+    def _iter_filter_packages(self, pkg_iter, replace=True):
+        '''
+        generator version of _filter_packages()
+        '''
+        index = self.installed_index
+        for pkg in pkg_iter:
+            inst_pkg = index.get(pkg)
+            if inst_pkg:
                 if replace:
-                    pkgs.append(inst_pkg)
+                    yield inst_pkg
             else:
-                pkgs.append(pkg)
-        return pkgs
+                yield pkg
 
 
     @property
@@ -75,21 +194,24 @@ class Packages:
         '''
         Get the query object from the current sack
         '''
-        return self._sack.query()
+        return self._query()
+
+    # NOTE package lists returned by the following properties are memoized
+    # and shared among callers, do not modify them
 
     @property
     def installed(self):
         '''
         get installed packages
         '''
-        return list(self.query.installed().run())
+        return self._cached('installed', lambda: list(self.installed_index), False)
 
     @property
     def updates(self):
         '''
         get available updates
         '''
-        return self.query.upgrades().run()
+        return self._cached('updates', lambda: self._sack.query().upgrades().run())
 
     @property
     def all(self,showdups = False):
@@ -98,9 +220,11 @@ class Packages:
         installed ones are replace with the install package objects
         '''
         if showdups:
-            return self._filter_packages(self.query.available().run())
+            return self._cached(('all', True),
+                lambda: self._filter_packages(self._sack.query().available().run()))
         else:
-            return self._filter_packages(self.query.latest().run())
+            return self._cached(('all', False),
+                lambda: self._filter_packages(self._sack.query().latest().run()))
 
     @property
     def available(self, showdups = False):
@@ -108,63 +232,224 @@ class Packages:
         available packages there is not installed yet
         '''
         if showdups:
-            return self._filter_packages(self.query.available().run(), replace=False)
+            return self._cached(('available', True),
+                lambda: self._filter_packages(self._sack.query().available().run(), replace=False))
         else:
-            return self._filter_packages(self.query.latest().run(), replace=False)
+            return self._cached(('available', False),
+                lambda: self._filter_packages(self._sack.query().latest().run(), replace=False))
+
+    def _extras(self):
+        '''
+        installed packages, not in current repos
+        '''
+        return list(self._iter_extras())
 
     @property
     def extras(self):
         '''
         installed packages, not in current repos
         '''
-        # anything installed but not in a repo is an extra
-        avail_dict = self.query.available().pkgtup_dict()
-        inst_dict = self.query.installed().pkgtup_dict()
-        pkgs = []
-        for pkgtup in inst_dict:
-            if pkgtup not in avail_dict:
-                pkgs.extend(inst_dict[pkgtup])
-        return pkgs
+        return self._cached('extras', self._extras)
+
+    def _obsoletes(self):
+        inst = self.query.installed()
+        return self.query.filter(obsoletes=inst)
 
     @property
     def obsoletes(self):
         '''
         packages there is obsoleting some installed packages
         '''
-        inst = self.query.installed()
-        return self.query.filter(obsoletes=inst)
+        return self._cached('obsoletes', self._obsoletes)
+
+    @instrument.traced()
+    def resolveNames(self, names, provides=False):
+        '''
+        resolve many package names with one query, for each name the most
+        up-to-date package is taken
+        :param names: package names
+        :param provides: look for packages providing the names not found by name
+        :return: a tuple (dictionary name -> package, list of names not found)
+        '''
+        wanted = []
+        seen = set()
+        for name in names:
+            if name not in seen:
+                seen.add(name)
+                wanted.append(name)
+
+        found = {}
+        if wanted:
+            for pkg in self.query.filter(name=wanted, latest=True).run():
+                if pkg.name not in found:
+                    found[pkg.name] = pkg
+
+        missing = [name for name in wanted if name not in found]
+        if provides and missing:
+            missing_set = set(missing)
+            for pkg in self.query.filter(provides=missing, latest=True).run():
+                for reldep in pkg.provides:
+                    name = str(reldep).split(' ', 1)[0]
+                    if name in missing_set and name not in found:
+                        found[name] = pkg
+            missing = [name for name in missing if name not in found]
 
+        return found, missing
+
+    @instrument.traced()
+    def resolveKeys(self, keys, query=None):
+        '''
+        resolve many package keys with one query
+        :param keys: PkgKey or pkg_id strings
+        :param query: the query to look into (default available packages)
+        :return: a dictionary PkgKey -> package, keys not found are missing
+        '''
+        wanted = set()
+        with_repo = False
+        for k in keys:
+            key = k if isinstance(k, PkgKey) else PkgKey.from_string(k)
+            wanted.add(key)
+            with_repo = with_repo or key.repo != '*'
+        found = {}
+        if not wanted:
+            return found
+
+        if query is None:
+            query = self.query.available()
+        for pkg in query.filter(name=list(set(k.name for k in wanted))).run():
+            key = pkg_key(pkg)
+            if key in wanted and key not in found:
+                found[key] = pkg
+            if with_repo:
+                key = pkg_key(pkg, True)
+                if key in wanted and key not in found:
+                    found[key] = pkg
+        return found
+
+    def _protectedConf(self):
+        '''
+        returns a tuple (dictionary file -> mtime, protected names) from the
+        dnf protected configuration files
+        '''
+        mtimes = {}
+        names = []
+        for f in sorted(listdir(PROTECTED_CONF_PATH)) :
+            file_path = os.path.join(PROTECTED_CONF_PATH, f)
+            if not os.path.isfile(file_path):
+                continue
+            mtimes[file_path] = os.path.getmtime(file_path)
+            with open(file_path, 'r') as content_file:
+                for line in content_file:
+                    name = line.strip()
+                    if name and not name.startswith('#'):
+                        names.append(name)
+        return mtimes, names
+
+    def _loadProtected(self, mtimes, sack_key):
+        '''
+        returns the persisted protected packages if still valid or None
+        '''
+        try:
+            with open(snapshot.cache_path(self._base, PROTECTED_CACHE), 'r') as f:
+                cache = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if cache.get('files') != mtimes or cache.get('sack') != sack_key or \
+           cache.get('recursive') != self.protected_recursive:
+            return None
+
+        keys = set(PkgKey.from_string(k) for k in cache.get('keys', []))
+        protected = {}
+        if keys:
+            q = self.query.filter(name=list(set(k.name for k in keys)))
+            for pkg in q.run():
+                pkgid = pkg_key(pkg)
+                if pkgid in keys and pkgid not in protected:
+                    protected[pkgid] = pkg
+        self._required_seen = set(protected.keys())
+        return protected
+
+    def _saveProtected(self, mtimes, sack_key):
+        '''
+        persist the protected package keys
+        '''
+        cache = {
+            'files'    : mtimes,
+            'sack'     : sack_key,
+            'recursive': self.protected_recursive,
+            'keys'     : [str(k) for k in self._protected.keys()],
+        }
+        path = snapshot.cache_path(self._base, PROTECTED_CACHE)
+        try:
+            d = os.path.dirname(path)
+            if not os.path.isdir(d):
+                os.makedirs(d)
+            with open(path, 'w') as f:
+                json.dump(cache, f)
+        except (IOError, OSError) as e:
+            # not fatal, it will be computed again next time
+            print(e)
+
+    @instrument.traced()
+    def _addRequired(self, pkgs):
+        '''
+        add the installed packages required by pkgs, recursively, to protected
+        visited packages are remembered so that they are never walked again
+        '''
+        installed = self._query(False).installed()
+        frontier = list(pkgs)
+        while frontier:
+            reqs = set()
+            for pkg in frontier:
+                for reldep in pkg.requires:
+                    if not str(reldep).startswith('rpmlib('):
+                        reqs.add(reldep)
+            frontier = []
+            if not reqs:
+                break
+            # one query for each level of the graph
+            for pkg in installed.filter(provides=list(reqs)).run():
+                pkgid = pkg_key(pkg)
+                if pkgid in self._required_seen:
+                    continue
+                self._required_seen.add(pkgid)
+                if pkgid not in self._protected:
+                    self._protected[pkgid] = pkg
+                frontier.append(pkg)
+
+    @instrument.traced()
     def _cacheProtected(self) :
         '''
         gets all the protected packages
         '''
+        mtimes, names = self._protectedConf()
+        # protected packages are looked up in the sack without the excluded ones
+        sack_key = snapshot.SackSnapshot(self._base).key(excludes=True)
+        protected = self._loadProtected(mtimes, sack_key)
+        if protected is not None:
+            self._protected = protected
+            return
+
         self._protected = {}
-        protected_conf_path='/etc/dnf/protected.d'
-        conf_files = listdir(protected_conf_path)
-        for f in conf_files :
-            file_path = protected_conf_path + '/' + f
-            with open(file_path, 'r') as content_file:
-                for line in content_file:
-                    names=line.strip()
-                    if names:
-                        self._base.packages.all
-                        q = self._base.packages.query
-                        i = q.filter(provides=names,latest=False)
-                        pkgs = i.run()
-                        if len(pkgs) > 0:
-                            for pkg in pkgs:
-                                pkgid = pkg_id(pkg)
-                                if (not pkgid in self._protected.keys()) :
-                                    self._protected[pkgid] = pkg
-                                    # TODO it could be necessary to get recursive require
+        self._required_seen = set()
+        if names:
+            # all the protected names at once
+            for pkg in self.query.filter(provides=names).run():
+                pkgid = pkg_key(pkg)
+                if (not pkgid in self._protected) :
+                    self._protected[pkgid] = pkg
+        if self.protected_recursive:
+            self._required_seen.update(self._protected.keys())
+            self._addRequired(list(self._protected.values()))
+        self._saveProtected(mtimes, sack_key)
 
     def isProtected(self, pkg) :
         '''
         if pkg is not none returns if the given package is a protected one
         '''
-        if not self._protected :
+        if self._protected is None :
             self._cacheProtected()
-        found = pkg_id(pkg) in self._protected.keys()
+        found = pkg_key(pkg) in self._protected
 
         return found
 
@@ -174,39 +459,268 @@ class Packages:
         protected (base) package list, if clean_cache is True, cache them again
         NOTE that cleaning cache will loose all the added packages by addToProtected()
         '''
-        if not self._protected or clean_cache:
+        if self._protected is None or clean_cache:
             self._cacheProtected()
 
         return self._protected.values()
 
     def addToProtected(self, pkg):
         '''
-        add the given package to protected list
+        add the given package to protected list, and its requirements
+        too if protected_recursive is True
         '''
-        if not self._protected :
+        if self._protected is None :
             self._cacheProtected()
-        pkgid = pkg_id(pkg)
-        if (not pkgid in self._protected.keys()) :
+        pkgid = pkg_key(pkg)
+        if (not pkgid in self._protected) :
             self._protected[pkgid] = pkg
+        if self.protected_recursive and pkgid not in self._required_seen:
+            self._required_seen.add(pkgid)
+            self._addRequired([pkg])
 
 
-    @property
-    def recent(self, showdups=False):
+    def export(self, out, kind='installed', fmt='csv', fields=EXPORT_FIELDS):
         '''
-        Get the recent packages
+        write the metadata of a package listing as columns
+        :param out: file object, binary for fmt 'binary', text otherwise
+        :param kind: listing to export (installed, updates, extras, all, available)
+        :param fmt: 'csv', 'jsonl' or 'binary'
+        :param fields: fields to export (see EXPORT_FIELDS)
+        :return: the number of exported packages
         '''
-        recent = []
-        now = time()
-        recentlimit = now-(self._base.conf.recent*86400)
-        if showdups:
-            avail = self.query.available()
+        writers = {'csv': write_csv, 'jsonl': write_jsonl, 'binary': write_binary}
+        if kind not in ('installed', 'updates', 'extras', 'all', 'available') or fmt not in writers:
+            raise ValueError
+        columns = export_columns(getattr(self, kind), fields)
+        return writers[fmt](columns, out)
+
+    def _buildtime_index(self, showdups=False):
+        '''
+        latest (or all available if showdups) packages sorted by buildtime,
+        as a tuple (buildtimes, packages), memoized for the sack generation
+        '''
+        def build():
+            pkgs = sorted(self._latest_or_available(showdups).run(), key=lambda po: po.buildtime)
+            return array('q', (int(po.buildtime) for po in pkgs)), pkgs
+        return self._cached(('buildtime', showdups), build)
+
+    def recent(self, days=None, showdups=False, limit=None):
+        '''
+        Get the recent packages, the most recently built first
+        installed ones are replaced with the install package objects
+        :param days: built in the last days (default dnf recent configuration)
+        :param showdups: all the available versions instead of the latest ones
+        :param limit: max number of packages returned (default all)
+        '''
+        return list(self._iter_recent(days, showdups, limit))
+
+
+    # Streaming variants of the package listings, packages are yielded
+    # lazily within the [offset, offset+limit) window. A memoized list
+    # of the current sack generation is reused if any, no copy is done.
+
+    def _window(self, key, generate, offset, limit, available=True):
+        '''
+        yield the items of the memoized key result or of generate()
+        '''
+        self._base.ensure_sack(available)
+        if self._cache_generation == self._base.sack_generation and key in self._cache:
+            items = self._cache[key]
         else:
-            avail = self.query.latest()
-        for po in avail:
-            if int(po.buildtime) > recentlimit:
-                recent.append(po)
-        return recent
+            items = generate()
+        stop = None if limit is None else offset + limit
+        return itertools.islice(items, offset, stop)
+
+    def iter_installed(self, offset=0, limit=None):
+        '''
+        yield installed packages
+        '''
+        return self._window('installed', lambda: iter(self.installed_index), offset, limit, False)
+
+    def iter_updates(self, offset=0, limit=None):
+        '''
+        yield available updates
+        '''
+        return self._window('updates', lambda: iter(self._sack.query().upgrades()), offset, limit)
+
+    def _latest_or_available(self, showdups):
+        q = self._sack.query()
+        return q.available() if showdups else q.latest()
+
+    def iter_all(self, showdups=False, offset=0, limit=None):
+        '''
+        yield all packages in the repositories,
+        installed ones are replaced with the install package objects
+        '''
+        return self._window(('all', showdups),
+                            lambda: self._iter_filter_packages(self._latest_or_available(showdups)),
+                            offset, limit)
+
+    def iter_available(self, showdups=False, offset=0, limit=None):
+        '''
+        yield available packages there is not installed yet
+        '''
+        return self._window(('available', showdups),
+                            lambda: self._iter_filter_packages(self._latest_or_available(showdups),
+                                                               replace=False),
+                            offset, limit)
+
+    def _iter_extras(self):
+        # anything installed but not in a repo is an extra,
+        # only available packages with an installed name are looked at
+        index = self.installed_index
+        avail = set()
+        for pkg in self.query.available().filter(name=index.names()):
+            avail.add(pkg_key(pkg))
+        for key, pkg in index.items():
+            if key not in avail:
+                yield pkg
+
+    def iter_extras(self, offset=0, limit=None):
+        '''
+        yield installed packages, not in current repos
+        '''
+        return self._window('extras', self._iter_extras, offset, limit)
+
+    def _iter_recent(self, days=None, showdups=False, limit=None):
+        if days is None:
+            days = self._base.conf.recent
+        recentlimit = time()-(days*86400)
+        buildtimes, pkgs = self._buildtime_index(showdups)
+        # packages built after recentlimit, newest first
+        start = bisect.bisect_right(buildtimes, recentlimit)
+        recent = (pkgs[i] for i in range(len(pkgs) - 1, start - 1, -1))
+
+        def unique():
+            # installed ones are replaced with the install package objects,
+            # latest() has both the installed and the available one
+            seen = set()
+            for pkg in self._iter_filter_packages(recent):
+                pkgid = pkg_key(pkg)
+                if pkgid not in seen:
+                    seen.add(pkgid)
+                    yield pkg
+        return itertools.islice(unique(), limit)
+
+    def iter_recent(self, days=None, showdups=False, offset=0, limit=None):
+        '''
+        yield the recent packages, the most recently built first
+        '''
+        stop = None if limit is None else offset + limit
+        return itertools.islice(self._iter_recent(days, showdups, stop), offset, None)
+
+
+class InstalledIndex:
+    '''
+    Installed packages indexed by (name, arch) and by PkgKey.
+    It is built on first use by the given loader (an iterable of installed
+    packages) and then kept up to date with sync() when a new sack is filled
+    (see Packages.sack_replaced()) instead of querying the rpmdb again.
+    It is not locked, sync() from another thread (see DnfBase.watch_rpmdb())
+    must be serialized with the readers by the caller
+    '''
 
+    def __init__(self, loader=None):
+        self._loader = loader
+        self._by_na = None
+        self._by_key = None
+
+    def _ensure(self):
+        if self._by_key is None:
+            self.rebuild()
+
+    def is_built(self):
+        return self._by_key is not None
+
+    @instrument.traced()
+    def rebuild(self, pkgs=None):
+        '''
+        build the index again from pkgs or from the loader
+        '''
+        self._by_na = {}
+        self._by_key = {}
+        if pkgs is None:
+            pkgs = self._loader() if self._loader else []
+        for pkg in pkgs:
+            self._add(pkg)
+
+    @instrument.traced()
+    def sync(self, pkgs):
+        '''
+        update the index to the given installed packages, objects of the
+        packages still installed are replaced too (new sack)
+        :return: a tuple (added PkgKey list, removed PkgKey list)
+        '''
+        old = self._by_key or {}
+        by_key = {}
+        by_na = {}
+        added = []
+        for pkg in pkgs:
+            key = pkg_key(pkg)
+            if key in by_key:
+                continue
+            if key not in old:
+                added.append(key)
+            by_key[key] = pkg
+            by_na.setdefault((pkg.name, pkg.arch), []).append(pkg)
+        removed = [key for key in old if key not in by_key]
+        self._by_key = by_key
+        self._by_na = by_na
+        return added, removed
+
+    def _add(self, pkg):
+        key = pkg_key(pkg)
+        if key in self._by_key:
+            return
+        self._by_key[key] = pkg
+        self._by_na.setdefault((pkg.name, pkg.arch), []).append(pkg)
+
+    def get(self, pkg):
+        '''
+        return the installed package with the same nevra of pkg or None
+        '''
+        self._ensure()
+        return self._by_key.get(pkg_key(pkg))
+
+    def by_name_arch(self, name, arch):
+        '''
+        return the list of installed packages with the given name and arch
+        '''
+        self._ensure()
+        return self._by_na.get((name, arch), [])
+
+    def is_installed(self, pkg):
+        '''
+        return if a package with the same nevra of pkg is installed
+        '''
+        self._ensure()
+        return pkg_key(pkg) in self._by_key
+
+    def names(self):
+        '''
+        return the installed package names
+        '''
+        self._ensure()
+        return list(set(name for name, arch in self._by_na))
+
+    def items(self):
+        '''
+        return (PkgKey, package) pairs
+        '''
+        self._ensure()
+        return self._by_key.items()
+
+    def __iter__(self):
+        self._ensure()
+        return iter(list(self._by_key.values()))
+
+    def __len__(self):
+        self._ensure()
+        return len(self._by_key)
+
+    def __contains__(self, key):
+        self._ensure()
+        return key in self._by_key
 
 
 class PackageQueue:
@@ -215,9 +729,13 @@ class PackageQueue:
     '''
 
     def __init__(self):
+        # action -> queued keys, dict is used as an insertion-ordered set
         self.packages = {}
         self.actions = {}
         self._download_size = 0
+        self._total = 0
+        # InstalledIndex used to know installed status, if any
+        self.installed_index = None
         self.QUEUE_PACKAGE_TYPES = {
             'i' : 'install',
             'u' : 'update',
@@ -231,7 +749,7 @@ class PackageQueue:
 
     def _setup_packages(self):
         for key in self.QUEUE_PACKAGE_TYPES.keys():
-            self.packages[key] = []
+            self.packages[key] = {}
 
     def clear(self):
         del self.packages
@@ -239,49 +757,65 @@ class PackageQueue:
         self._setup_packages()
         self.actions = {}
         self._download_size = 0
+        self._total = 0
 
 
     def get(self, action=None):
+        '''
+        returns the queued keys list of the given action, or a dictionary
+        action -> keys list if action is None
+        '''
         if action is None:
-            return self.packages
+            return dict((key, list(value)) for key, value in self.packages.items())
         else:
-            return self.packages[action]
+            return list(self.packages[action])
 
     def total(self):
-        num = 0
-        for key in self.QUEUE_PACKAGE_TYPES.keys():
-            num += len(self.packages[key])
-        return num
+        return self._total
 
     def downloadsize(self):
-      ''' returns the current total download size '''
+      ''' returns the current total (raw) download size, see functions.selectedSize '''
       return self._download_size
 
+    def _enqueue(self, pkgid, action):
+      self.packages[action][pkgid] = None
+      self.actions[pkgid] = action
+      self._total += 1
+
+    def _dequeue(self, pkgid):
+      action = self.actions.pop(pkgid)
+      del self.packages[action][pkgid]
+      self._total -= 1
+      return action
+
     def add(self, pkg, action):
       """Add a package to queue"""
-      pkgid = pkg_id(pkg)
-      if pkgid in self.actions.keys():
+      pkgid = pkg_key(pkg)
+      if pkgid in self.actions:
         old_action = self.actions[pkgid]
         if old_action != action:
           # decrease size if old action was to install, update or reinstall a package
           if old_action == 'i' or old_action == 'ri' or old_action == 'u':
             self._download_size -= pkg.downloadsize
-          self.packages[old_action].remove(pkgid)
+          self._dequeue(pkgid)
           if (pkg.installed and action != 'i' or not pkg.installed and action != 'r'):
-            self.packages[action].append(pkgid)
-            self.actions[pkgid] = action
+            self._enqueue(pkgid, action)
             # increase size if old action was to install, update or reinstall a package
             if action == 'i' or action == 'ri' or action == 'u':
               self._download_size += pkg.downloadsize
-          else:
-            del self.actions[pkgid]
       else:
-        self.packages[action].append(pkgid)
-        self.actions[pkgid] = action
+        self._enqueue(pkgid, action)
         # increase size if old action was to install, update or reinstall a package
         if action == 'i' or action == 'ri' or action == 'u':
           self._download_size += pkg.downloadsize
 
+    def add_many(self, pkgs, action):
+      '''
+      add all the given packages to queue with the same action
+      '''
+      for pkg in pkgs:
+        self.add(pkg, action)
+
     def add_to_install(self, pkg):
       '''
       add pkg with action 'i' (shortcut)
@@ -298,45 +832,57 @@ class PackageQueue:
       '''
       returns if a package has to be checked in gui pacakge-list
       '''
-      pkgid = pkg_id(pkg)
-      if pkgid in self.actions.keys():
-        return pkg.installed and self.actions[pkgid] != 'r' or self.actions[pkgid] != 'r'
+      pkgid = pkg_key(pkg)
+      if pkgid in self.actions:
+        return self.actions[pkgid] != 'r'
+      if self.installed_index is not None:
+        return pkgid in self.installed_index
       return pkg.installed
 
     def action(self, pkg):
       '''
       returns the action of the queued package or None if pacakge is not queued
       '''
-      pkgid = pkg_id(pkg)
-      if pkgid in self.actions.keys():
-        return self.actions[pkgid]
-      return None
+      return self.actions.get(pkg_key(pkg))
 
     def remove(self, pkg):
       """Remove package from queue"""
-      pkgid = pkg_id(pkg)
-      if pkgid in self.actions.keys():
-        action = self.actions[pkgid]
-        self.packages[action].remove(pkgid)
-        del self.actions[pkgid]
+      pkgid = pkg_key(pkg)
+      if pkgid in self.actions:
+        action = self._dequeue(pkgid)
+        if action == 'i' or action == 'ri' or action == 'u':
+          self._download_size -= pkg.downloadsize
+
+    def remove_many(self, pkgs):
+      '''
+      remove all the given packages from queue
+      '''
+      for pkg in pkgs:
+        self.remove(pkg)
 
     def install_list(self):
       '''
       return the install package list
       '''
-      return self.packages['i']
+      return list(self.packages['i'])
 
     def update_list(self):
       '''
       return the update package list
       '''
-      return self.packages['u']
+      return list(self.packages['u'])
 
     def uninstall_list(self):
       '''
       return the uninstall package list
       '''
-      return self.packages['r']
+      return list(self.packages['r'])
+
+    def reinstall_list(self):
+      '''
+      return the reinstall package list
+      '''
+      return list(self.packages['ri'])
 
 
 def get_pkg_info(pkg):
@@ -348,20 +894,53 @@ def get_pkg_info(pkg):
 
     return pkg.description
 
-def pkg_id(pkg, with_repo=False):
+class PkgKey(collections.namedtuple('PkgKey', 'name epoch version release arch repo')):
   '''
-  return pkg_id as nevra from a dnf.package.Package
+  Compact hashable package key, nevra and repo id (or "*").
+  Keys are interned, use pkg_key() or PkgKey.from_string() to get them,
+  str() returns the pkg_id string form
+  '''
+  __slots__ = ()
+
+  def __str__(self):
+    return ','.join(self)
+
+  @classmethod
+  def from_string(cls, pkg_id):
+    '''
+    return the key of the given pkg_id string
+    '''
+    return _intern_key(cls(*str(pkg_id).split(',')))
+
+_pkg_keys = {}
+
+def _intern_key(key):
+  '''
+  return the unique instance of key
+  '''
+  return _pkg_keys.setdefault(key, key)
+
+def pkg_key(pkg, with_repo=False):
+  '''
+  return the PkgKey of a dnf.package.Package
   '''
   if not isinstance(pkg, dnf.package.Package):
     raise ValueError
-  if with_repo:
-    return "%s,%s,%s,%s,%s,%s" % (pkg.name, pkg.epoch, pkg.version, pkg.release, pkg.arch, pkg.reponame)
 
-  return "%s,%s,%s,%s,%s,*" % (pkg.name, pkg.epoch, pkg.version, pkg.release, pkg.arch)
+  return _intern_key(PkgKey(pkg.name, str(pkg.epoch), pkg.version, pkg.release, pkg.arch,
+                            pkg.reponame if with_repo else '*'))
+
+def pkg_id(pkg, with_repo=False):
+  '''
+  return pkg_id as nevra from a dnf.package.Package
+  '''
+  return str(pkg_key(pkg, with_repo))
 
 
 def to_pkg_tuple(pkg_id):
-  """Find the real package nevra & repoid (or *) from a package pkg_id"""
+  """Find the real package nevra & repoid (or *) from a package pkg_id or PkgKey"""
+  if isinstance(pkg_id, PkgKey):
+    return tuple(pkg_id)
   (n, e, v, r, a, repo_id) = str(pkg_id).split(',')
   return (n, e, v, r, a, repo_id)
 
@@ -388,7 +967,118 @@ def fullname(pkg):
       return "%s-%s-%s.%s" % (pkg.name, pkg.version, pkg.release, pkg.arch)
 
 
+def export_columns(pkgs, fields=EXPORT_FIELDS):
+    '''
+    return the given fields of pkgs as an ordered dictionary field -> column,
+    integer fields are array('q'), the others lists of strings.
+    Values are taken one field at a time, no per package record is built,
+    pkgs can be any iterable (e.g. iter_installed()) it is read once
+    '''
+    if not isinstance(pkgs, (list, tuple)):
+        pkgs = list(pkgs)
+    columns = collections.OrderedDict()
+    for field in fields:
+        if field not in EXPORT_FIELDS:
+            raise ValueError(field)
+        values = map(operator.attrgetter(field), pkgs)
+        if field in EXPORT_INT_FIELDS:
+            columns[field] = array('q', (int(v or 0) for v in values))
+        else:
+            columns[field] = [v or '' for v in values]
+    return columns
 
+def _rows(columns):
+    return zip(*columns.values())
 
+def write_csv(columns, out):
+    '''
+    write columns as CSV with a header line, returns the number of rows
+    '''
+    writer = csv.writer(out)
+    writer.writerow(list(columns.keys()))
+    n = 0
+    for row in _rows(columns):
+        writer.writerow(row)
+        n += 1
+    return n
 
+def write_jsonl(columns, out):
+    '''
+    write columns as JSON lines, one object per package, returns the number of rows
+    '''
+    names = list(columns.keys())
+    encode = json.JSONEncoder(ensure_ascii=False).encode
+    n = 0
+    for row in _rows(columns):
+        out.write(encode(dict(zip(names, row))))
+        out.write('\n')
+        n += 1
+    return n
 
+def write_binary(columns, out):
+    '''
+    write columns in the compact binary format (little endian):
+      header:  magic, format (u16), rows (u32), fields (u16)
+      fields:  name length (u16), name, type ('q' int64 or 's' string)
+      columns: int64 values, or u32 offsets (rows + 1) and the UTF-8 data
+    returns the number of rows
+    '''
+    rows = len(next(iter(columns.values()))) if columns else 0
+    out.write(EXPORT_MAGIC + struct.pack('<HIH', EXPORT_FORMAT, rows, len(columns)))
+    for name, column in columns.items():
+        bname = name.encode('utf-8')
+        out.write(struct.pack('<H', len(bname)) + bname + (b'q' if isinstance(column, array) else b's'))
+    for column in columns.values():
+        if isinstance(column, array):
+            data = array('q', column)
+            if sys.byteorder != 'little':
+                data.byteswap()
+            out.write(data.tobytes())
+        else:
+            blob = [v.encode('utf-8') for v in column]
+            offsets = array('I', [0])
+            total = 0
+            for b in blob:
+                total += len(b)
+                offsets.append(total)
+            if sys.byteorder != 'little':
+                offsets.byteswap()
+            out.write(offsets.tobytes())
+            out.write(b''.join(blob))
+    return rows
+
+def read_binary(stream):
+    '''
+    read columns written by write_binary(), returns an ordered dictionary
+    '''
+    def read(n):
+        data = stream.read(n)
+        if len(data) != n:
+            raise ValueError("truncated package export")
+        return data
+
+    if read(4) != EXPORT_MAGIC:
+        raise ValueError("not a package export")
+    version, rows, nfields = struct.unpack('<HIH', read(8))
+    if version != EXPORT_FORMAT:
+        raise ValueError("unsupported package export format %d" % version)
+    layout = []
+    for i in range(nfields):
+        (length,) = struct.unpack('<H', read(2))
+        layout.append((read(length).decode('utf-8'), read(1)))
+    columns = collections.OrderedDict()
+    for name, kind in layout:
+        if kind == b'q':
+            column = array('q')
+            column.frombytes(read(8 * rows))
+            if sys.byteorder != 'little':
+                column.byteswap()
+        else:
+            offsets = array('I')
+            offsets.frombytes(read(4 * (rows + 1)))
+            if sys.byteorder != 'little':
+                offsets.byteswap()
+            blob = read(offsets[rows])
+            column = [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(rows)]
+        columns[name] = column
+    return columns
@@ -0,0 +1,207 @@
+# vim: set fileencoding=utf-8 :
+# vim: set et ts=4 sw=4:
+'''
+ManaTools is a generic launcher application that can run
+internal or external modules, such as system configuration tools.
+
+ManaTools is also a collection of configuration tools that allows
+users to configure most of their system components in a very simple,
+intuitive and attractive interface. It consists of some modules
+that can be also run as autonomous applications.
+
+Python-ManaTools is a python framework to write manatools application
+written in python, this project started from perl manatools experience
+and its aim is to give an easy and common interface to develop and add
+new modules based on libYui. Every modules can be run using QT, Gtk or
+ncurses interface.
+
+License: LGPLv2+
+
+Author:  Angelo Naselli <anaselli@linux.it>
+
+@package manatools.pkgs.planner
+'''
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import collections
+import hawkey
+
+import manatools.pkgs.packages as pkgs
+import manatools.pkgs.download as download
+import manatools.pkgs.instrument as instrument
+
+''' queue actions resolved as installs, the others are erasures '''
+INSTALL_ACTIONS = ('i', 'u', 'o', 'ri', 'do', 'li')
+
+
+class TransactionPlan:
+    '''
+    Result of a dry-run depsolve of the package queue
+    '''
+
+    def __init__(self, ok, problems=None):
+        self.ok = ok
+        self.problems = problems or []
+        self.installs = []
+        self.upgrades = []
+        self.downgrades = []
+        self.reinstalls = []
+        self.removes = []
+        self.obsoleted = []
+        self.missing = []
+        self.download = download.DownloadPlan()
+
+    def to_install(self):
+        '''
+        return all the packages coming in (installs, upgrades, ...)
+        '''
+        return self.installs + self.upgrades + self.downgrades + self.reinstalls
+
+    @property
+    def download_size(self):
+        return self.download.download_size
+
+    @property
+    def install_size(self):
+        return sum(pkg.installsize for pkg in self.to_install())
+
+    @property
+    def remove_size(self):
+        return sum(pkg.installsize for pkg in self.removes + self.obsoleted)
+
+
+class DryRunPlanner:
+    '''
+    Memoized dry-run depsolve of DnfBase.packageQueue.
+    Results are cached by queue content, sack generation and
+    allow_erasing (LRU), the base goal and transaction are never touched.
+    The goal is a copy of the base one (protected packages and any other
+    job already set there) solved with the same flags dnf.Base.resolve()
+    uses: best, install_weak_deps, clean_requirements_on_remove and the
+    userinstalled packages when something is erased. Unlike resolve() it
+    does not apply module, exclude or versionlock changes made after the
+    sack was filled and does not check protected removals. hawkey has no
+    incremental solver, a queue change that does not change the
+    problem (new install entries already pulled in by the previous
+    solution) reuses the previous plan without solving again.
+    '''
+
+    def __init__(self, base, max_entries=32):
+        self._base = base
+        self.max_entries = max_entries
+        self._cache = collections.OrderedDict()
+        self._last = None
+        self._download = None
+        self.solved = 0
+        self.reused = 0
+
+    def _state(self):
+        return frozenset(self._base.packageQueue.actions.items())
+
+    def invalidate(self):
+        self._cache.clear()
+        self._last = None
+        self._download = None
+
+    def download(self):
+        '''
+        return the download.DownloadPlan of the queued install, update and
+        reinstall packages (no depsolve), memoized by queue content and
+        sack generation
+        '''
+        base = self._base
+        base.ensure_sack()
+        key = (self._state(), base.sack_generation)
+        if self._download is not None and self._download[0] == key:
+            return self._download[1]
+
+        queue = base.packageQueue
+        keys = queue.install_list() + queue.update_list() + queue.reinstall_list()
+        found = base.packages.resolveKeys(keys)
+        result = download.plan(base, [found[k] for k in keys if k in found])
+        self._download = (key, result)
+        return result
+
+    def plan(self, allow_erasing=False):
+        '''
+        return the TransactionPlan of the current queue, allow_erasing
+        as in dnf.Base.resolve()
+        '''
+        base = self._base
+        base.ensure_sack()
+        state = self._state()
+        key = (state, base.sack_generation, allow_erasing)
+        result = self._cache.get(key)
+        if result is not None:
+            self._cache.move_to_end(key)
+            self.reused += 1
+            return result
+
+        result = self._incremental(state, allow_erasing)
+        if result is None:
+            result = self._solve(state, allow_erasing)
+            self.solved += 1
+        else:
+            self.reused += 1
+        self._last = (state, base.sack_generation, allow_erasing, result)
+        self._cache[key] = result
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return result
+
+    def _incremental(self, state, allow_erasing):
+        '''
+        return the previous plan if the new queue entries do not change it
+        '''
+        if self._last is None:
+            return None
+        last_state, generation, last_erasing, last_plan = self._last
+        if generation != self._base.sack_generation or not last_plan.ok:
+            return None
+        if last_erasing != allow_erasing:
+            return None
+        if not last_state <= state:
+            return None
+        incoming = set(pkgs.pkg_key(pkg) for pkg in last_plan.to_install())
+        for pkgid, action in state - last_state:
+            if action not in INSTALL_ACTIONS or pkgid not in incoming:
+                return None
+        return last_plan
+
+    @instrument.traced()
+    def _solve(self, state, allow_erasing):
+        base = self._base
+        conf = base.conf
+        p = base.packages
+        install_keys = [k for k, action in state if action in INSTALL_ACTIONS]
+        erase_keys = [k for k, action in state if action not in INSTALL_ACTIONS]
+        available = p.resolveKeys(install_keys)
+        installed = p.resolveKeys(erase_keys, base.sack.query().installed())
+        missing = [k for k in install_keys if k not in available]
+
+        # a copy of the base goal keeps protected packages and the jobs
+        # already added there, the base one is left untouched
+        goal = hawkey.Goal(base._goal)
+        for pkg in available.values():
+            goal.install(pkg)
+        for pkg in installed.values():
+            goal.erase(pkg, clean_deps=conf.clean_requirements_on_remove)
+        missing.extend(k for k in erase_keys if k not in installed)
+        if goal.req_has_erase() and hasattr(base, '_push_userinstalled'):
+            base._push_userinstalled(goal)
+
+        ok = goal.run(allow_uninstall=allow_erasing, force_best=conf.best,
+                      ignore_weak_deps=not conf.install_weak_deps)
+        result = TransactionPlan(ok, [] if ok else list(goal.problems))
+        result.missing = missing
+        if ok:
+            result.installs = list(goal.list_installs())
+            result.upgrades = list(goal.list_upgrades())
+            result.downgrades = list(goal.list_downgrades())
+            result.reinstalls = list(goal.list_reinstalls())
+            result.removes = list(goal.list_erasures())
+            result.obsoleted = list(goal.list_obsoleted())
+            result.download = download.plan(base, result.to_install())
+        return result
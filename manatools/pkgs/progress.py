@@ -28,6 +28,8 @@ from __future__ import absolute_import
 from time import time
 from os import listdir
 import sys
+import json
+import threading
 import dnf
 import dnf.yum
 import dnf.const
@@ -42,12 +44,83 @@ import hawkey
 import gettext
 from gettext import gettext as _
 
+class TtySink:
+    '''
+        writes progress on a terminal (default stdout)
+    '''
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def write(self, state):
+        event = state['event']
+        if event == 'start':
+            self.stream.write(_("Downloading :  %d files,  %d bytes\n") % (state['total_files'], state['total_size']))
+        elif event == 'file':
+            self.stream.write(_("Starting to download : %s \n") % state['payload'])
+        elif not state['metadata']:
+            line = _("Progress : %-3d %% (%d/%d)") % (state['percent'], state['files'], state['total_files'])
+            if state['rate']:
+                line += " %s/s" % format_size(state['rate'])
+            if state['eta'] is not None:
+                line += _(" ETA %s") % format_time(state['eta'])
+            self.stream.write(line + "\r")
+        self.stream.flush()
+
+
+class JsonLinesSink:
+    '''
+        writes progress states as JSON lines
+    '''
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, state):
+        self.stream.write(json.dumps(state) + "\n")
+        self.stream.flush()
+
+
+class CallbackSink:
+    '''
+        calls callback(state) for every progress state
+    '''
+    def __init__(self, callback):
+        self.callback = callback
+
+    def write(self, state):
+        self.callback(state)
+
+
+def format_size(size):
+    ''' human readable size '''
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if size < 1024.0 or unit == 'GB':
+            return "%.1f %s" % (size, unit)
+        size /= 1024.0
+
+def format_time(seconds):
+    ''' mm:ss or hh:mm:ss '''
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return "%d:%02d:%02d" % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+    return "%02d:%02d" % (seconds // 60, seconds % 60)
+
+
 class Progress(DownloadProgress):
     '''
-        cli progress bar example
+        cli progress bar example.
+        The downloaded total is kept up to date at every callback and the
+        output is rate limited, it is rendered when the percentage grew
+        by min_step and min_interval seconds passed since the last output,
+        and at least every refresh_interval seconds while downloading, so
+        that rate and ETA are updated also if the percentage does not move.
+        Output goes to sinks (default a TtySink)
     '''
-    def __init__(self):
+    def __init__(self, sinks=None, min_interval=0.2, min_step=1, refresh_interval=1.0):
         super(Progress, self).__init__()
+        self.sinks = sinks if sinks is not None else [TtySink()]
+        self.min_interval = min_interval
+        self.min_step = min_step
+        self.refresh_interval = refresh_interval
         self.total_files = 0
         self.total_size = 0.0
         self.download_files = 0
@@ -55,17 +128,27 @@ class Progress(DownloadProgress):
         self.dnl = {}
         self.last_pct = 0
         self._guess_metadata = False
+        self._start_time = time()
+        self._last_render = 0.0
 
-    def start(self, total_files, total_size):
-        print(_("Downloading :  %d files,  %d bytes") % (total_files, total_size))
+    def _emit(self, state):
+        for sink in self.sinks:
+            sink.write(state)
+
+    def start(self, total_files, total_size, total_drpms=0):
         self.total_files = total_files
         self.total_size = total_size
         self.download_files = 0
         self.download_size = 0.0
+        self.dnl = {}
         self.last_pct = 0
         self._guess_metadata = False
+        self._start_time = time()
+        self._last_render = 0.0
+        self._emit({'event': 'start', 'total_files': total_files, 'total_size': total_size})
 
     def end(self,payload, status, msg):
+        self.last_pct = max(self.last_pct, self.get_total())
         if not status: # payload download complete
             self.download_files += 1
             self.update()
@@ -76,31 +159,84 @@ class Progress(DownloadProgress):
         pload = str(payload)
         if not pload in self.dnl:
             self.dnl[pload] = 0.0
-            print(_("Starting to download : %s ") % str(payload))
+            self._emit({'event': 'file', 'payload': pload})
         else:
+            # keep the running total
+            self.download_size += done - self.dnl[pload]
             self.dnl[pload] = done
             pct = self.get_total()
-            if pct > self.last_pct:
-                self.last_pct = pct
-                self.update()
-
+            now = time()
+            elapsed = now - self._last_render
+            if (pct >= self.last_pct + self.min_step and elapsed >= self.min_interval) or \
+                    elapsed >= self.refresh_interval:
+                self.last_pct = max(self.last_pct, pct)
+                self.update(now)
 
     def get_total(self):
         """ Get the total downloaded percentage"""
-        tot = 0.0
-        for value in self.dnl.values():
-            tot += value
+        tot = self.download_size
         #pct make sense in file download, repo metadata total_size is always 1 :(
         if self.total_size >= tot:
-            pct = int((tot / float(self.total_size)) * 100)
+            pct = int((tot / float(self.total_size)) * 100) if self.total_size else 0
         else:
             pct = int(tot)
             self._guess_metadata = True
         return pct
 
-    def update(self):
+    def rate(self, now=None):
+        """ download rate in bytes per second """
+        elapsed = (now or time()) - self._start_time
+        if elapsed <= 0:
+            return 0.0
+        return self.download_size / elapsed
+
+    def eta(self, now=None):
+        """ estimated seconds to the end or None """
+        rate = self.rate(now)
+        if not rate or self._guess_metadata or self.total_size < self.download_size:
+            return None
+        return (self.total_size - self.download_size) / rate
+
+    def update(self, now=None):
         """ Output the current progress"""
-        if not self._guess_metadata:
-            sys.stdout.write(_("Progress : %-3d %% (%d/%d)\r") % (self.last_pct,self.download_files, self.total_files))
+        now = now or time()
+        self._last_render = now
+        self._emit({
+            'event'      : 'progress',
+            'percent'    : self.last_pct,
+            'files'      : self.download_files,
+            'total_files': self.total_files,
+            'size'       : self.download_size,
+            'total_size' : self.total_size,
+            'rate'       : self.rate(now),
+            'eta'        : self.eta(now),
+            'metadata'   : self._guess_metadata,
+        })
+
+
+class SerializedProgress(DownloadProgress):
+    '''
+        wraps a progress bar to be driven by concurrent downloads,
+        such as repositories loaded in parallel, callbacks are serialized
+        and start() is forwarded once for all the expected downloads
+    '''
+    def __init__(self, progress, total_files):
+        super(SerializedProgress, self).__init__()
+        self._progress = progress
+        self._total_files = total_files
+        self._lock = threading.Lock()
+        self._started = False
 
+    def start(self, total_files, total_size):
+        with self._lock:
+            if not self._started:
+                self._started = True
+                self._progress.start(max(total_files, self._total_files), total_size * self._total_files)
+
+    def end(self, payload, status, msg):
+        with self._lock:
+            self._progress.end(payload, status, msg)
 
+    def progress(self, payload, done):
+        with self._lock:
+            self._progress.progress(payload, done)
@@ -0,0 +1,490 @@
+# vim: set fileencoding=utf-8 :
+# vim: set et ts=4 sw=4:
+'''
+ManaTools is a generic launcher application that can run
+internal or external modules, such as system configuration tools.
+
+ManaTools is also a collection of configuration tools that allows
+users to configure most of their system components in a very simple,
+intuitive and attractive interface. It consists of some modules
+that can be also run as autonomous applications.
+
+Python-ManaTools is a python framework to write manatools application
+written in python, this project started from perl manatools experience
+and its aim is to give an easy and common interface to develop and add
+new modules based on libYui. Every modules can be run using QT, Gtk or
+ncurses interface.
+
+License: LGPLv2+
+
+Author:  Angelo Naselli <anaselli@linux.it>
+
+@package manatools.pkgs.search
+'''
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import re
+import sys
+import json
+import bisect
+import threading
+import itertools
+from array import array
+import hawkey
+
+import manatools.pkgs.packages as pkgs
+import manatools.pkgs.snapshot as snapshot
+import manatools.pkgs.instrument as instrument
+
+''' package fields in the search index '''
+INDEXED_FIELDS = ('name', 'summary', 'description', 'url')
+''' rank weight of a match in each field '''
+FIELD_WEIGHTS = {'name': 20, 'summary': 5, 'description': 2, 'url': 1}
+''' persisted search index, a JSON header line followed by the trigram
+    postings as native uint32 (data only, nothing is executed at load) '''
+INDEX_CACHE = 'search-index.data'
+INDEX_FORMAT = 2
+
+_word_re = re.compile(r'\w+', re.UNICODE)
+
+def _trigrams(text):
+    return set(text[i:i+3] for i in range(len(text) - 2))
+
+
+class SearchIndex:
+    '''
+    In-memory index over name, summary, description and url of all the
+    packages in the sack, it answers the same case insensitive substring
+    searches of DnfBase.contains() using a trigram index, and word
+    prefix searches using a sorted word list.
+    Excluded packages are indexed too, so that a persisted index does not
+    depend on the excludes, they are filtered out of the search results.
+    '''
+
+    def __init__(self, base):
+        self._base = base
+        self.generation = None
+        self._pkgs = []
+        self._text = {}
+        self._trigrams = {}
+        self._words = {}
+        self._sorted_words = []
+        self._pos = None
+        self._visible = None
+
+    @classmethod
+    def load_or_build(cls, base, persist=True):
+        '''
+        return the index of the current base sack, loading it from the
+        cache beside the dnf metadata if the sack did not change
+        '''
+        index = cls(base)
+        sack_key = snapshot.SackSnapshot(base).key() if persist else None
+        if not persist or not index.load(sack_key):
+            index.build()
+            if persist:
+                index.save(sack_key)
+        index.generation = base.sack_generation
+        return index
+
+    @instrument.traced()
+    def build(self):
+        '''
+        build the index from the base sack
+        '''
+        self._pkgs = self._base.sack.query(flags=hawkey.IGNORE_EXCLUDES).run()
+        self._text = {}
+        self._trigrams = {}
+        for field in INDEXED_FIELDS:
+            texts = []
+            grams = {}
+            for i, pkg in enumerate(self._pkgs):
+                text = (getattr(pkg, field, None) or '').lower()
+                texts.append(text)
+                for gram in _trigrams(text):
+                    grams.setdefault(gram, array('I')).append(i)
+            self._text[field] = texts
+            self._trigrams[field] = grams
+        self._build_words()
+
+    def _build_words(self):
+        words = {}
+        for field in ('name', 'summary'):
+            for i, text in enumerate(self._text[field]):
+                for word in _word_re.findall(text):
+                    words.setdefault(word, set()).add(i)
+        self._words = words
+        self._sorted_words = sorted(words)
+
+    def save(self, sack_key):
+        '''
+        persist the index, packages are stored by PkgKey
+        '''
+        postings = array('I')
+        grams = {}
+        for field in INDEXED_FIELDS:
+            counts = []
+            for gram, positions in self._trigrams[field].items():
+                counts.append([gram, len(positions)])
+                postings.extend(positions)
+            grams[field] = counts
+        header = {
+            'format'   : INDEX_FORMAT,
+            'sack'     : sack_key,
+            'itemsize' : postings.itemsize,
+            'byteorder': sys.byteorder,
+            'keys'     : [str(pkgs.pkg_key(pkg, True)) for pkg in self._pkgs],
+            'text'     : self._text,
+            'trigrams' : grams,
+        }
+        path = snapshot.cache_path(self._base, INDEX_CACHE)
+        try:
+            d = os.path.dirname(path)
+            if not os.path.isdir(d):
+                os.makedirs(d)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(json.dumps(header).encode('utf-8') + b'\n')
+                postings.tofile(f)
+            os.rename(path + '.tmp', path)
+        except (IOError, OSError) as e:
+            # not fatal, it will be built again next time
+            print(e)
+
+    def _read(self, path, sack_key):
+        '''
+        read the persisted index, returns (keys, text, trigrams) or None
+        '''
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline().decode('utf-8'))
+            if header.get('format') != INDEX_FORMAT or header.get('sack') != sack_key:
+                return None
+            postings = array('I')
+            if header['itemsize'] != postings.itemsize or header['byteorder'] != sys.byteorder:
+                return None
+            postings.frombytes(f.read())
+        keys = [str(k) for k in header['keys']]
+        text = {}
+        trigrams = {}
+        offset = 0
+        for field in INDEXED_FIELDS:
+            texts = [str(t) for t in header['text'][field]]
+            if len(texts) != len(keys):
+                return None
+            grams = {}
+            for gram, count in header['trigrams'][field]:
+                grams[str(gram)] = postings[offset:offset + count]
+                offset += count
+            text[field] = texts
+            trigrams[field] = grams
+        if offset != len(postings) or (postings and max(postings) >= len(keys)):
+            return None
+        return keys, text, trigrams
+
+    def load(self, sack_key):
+        '''
+        load the persisted index if it matches sack_key, returns True if done
+        '''
+        path = snapshot.cache_path(self._base, INDEX_CACHE)
+        try:
+            data = self._read(path, sack_key)
+        except Exception:
+            # missing or broken, it is built again
+            return False
+        if data is None:
+            return False
+
+        keys, text, trigrams = data
+        by_key = {}
+        for pkg in self._base.sack.query(flags=hawkey.IGNORE_EXCLUDES).run():
+            by_key[str(pkgs.pkg_key(pkg, True))] = pkg
+        # packages not in the sack are missing, they are never returned
+        self._pkgs = [by_key.get(k) for k in keys]
+        self._text = text
+        self._trigrams = trigrams
+        self._build_words()
+        return True
+
+    def _position(self, pkg):
+        if self._pos is None:
+            self._pos = dict((p, i) for i, p in enumerate(self._pkgs) if p is not None)
+        return self._pos.get(pkg)
+
+    def _visible_positions(self):
+        '''
+        positions of the packages not excluded from the sack
+        '''
+        if self._visible is None:
+            positions = (self._position(pkg) for pkg in self._base.sack.query().run())
+            self._visible = set(i for i in positions if i is not None)
+        return self._visible
+
+    def find(self, field, needle):
+        '''
+        return the set of package positions whose field contains needle
+        (case insensitive), not indexed fields are looked up in the sack
+        '''
+        if field not in self._text:
+            positions = set()
+            for pkg in self._base.contains(field, needle).run():
+                i = self._position(pkg)
+                if i is not None:
+                    positions.add(i)
+            return positions
+
+        needle = needle.lower()
+        texts = self._text[field]
+        if len(needle) < 3:
+            return set(i for i, text in enumerate(texts) if needle in text)
+        grams = self._trigrams[field]
+        candidates = None
+        # rarest trigrams first to keep intersections small
+        for gram in sorted(_trigrams(needle), key=lambda g: len(grams.get(g, ()))):
+            postings = grams.get(gram)
+            if not postings:
+                return set()
+            candidates = set(postings) if candidates is None else candidates.intersection(postings)
+            if not candidates:
+                return set()
+        return set(i for i in candidates if needle in texts[i])
+
+    def find_prefix(self, prefix):
+        '''
+        return the set of package positions having a name or summary
+        word starting with prefix (case insensitive)
+        '''
+        prefix = prefix.lower()
+        positions = set()
+        start = bisect.bisect_left(self._sorted_words, prefix)
+        for word in self._sorted_words[start:]:
+            if not word.startswith(prefix):
+                break
+            positions |= self._words[word]
+        return positions
+
+    def _score(self, i, values):
+        score = 0
+        name = self._text['name'][i]
+        for value in values:
+            value = value.lower()
+            if name == value:
+                score += 100
+            elif name.startswith(value):
+                score += 50
+            for field, weight in FIELD_WEIGHTS.items():
+                if value in self._text[field][i]:
+                    score += weight
+        return score
+
+    @instrument.traced()
+    def search(self, fields, values, match_all=True, showdups=False, limit=None,
+               prefix=False, ranked=True):
+        '''
+        search in a list of package fields for a list of keys,
+        same as DnfBase.search()
+        :param fields: package attributes to search in
+        :param values: the values to match
+        :param match_all: match all values (default)
+        :param showdups: show duplicate packages or latest (default)
+        :param limit: max number of packages returned
+        :param prefix: match name and summary words starting with values,
+                       instead of substrings of fields
+        :param ranked: sort by relevance (name matches first)
+        :return: a list of package objects
+        '''
+        matches = set()
+        for key in values:
+            if prefix:
+                key_set = self.find_prefix(key)
+            else:
+                key_set = set()
+                for attr in fields:
+                    key_set |= self.find(attr, key)
+            if len(matches) == 0:
+                matches = key_set
+            else:
+                if match_all:
+                    matches &= key_set
+                else:
+                    matches |= key_set
+
+        matches &= self._visible_positions()
+        result = [self._pkgs[i] for i in matches if self._pkgs[i] is not None]
+        if not showdups and result:
+            result = self._base.sack.query().filter(pkg=result).latest().run()
+        if ranked:
+            scores = {}
+            for i in matches:
+                if self._pkgs[i] is not None:
+                    scores[self._pkgs[i]] = self._score(i, values)
+            result.sort(key=lambda pkg: (-scores.get(pkg, 0), pkg.name))
+        if limit is not None:
+            result = result[:limit]
+        return result
+
+
+class SearchSession:
+    '''
+    Search-as-you-type session built on DnfBase.search().
+    When the new text only extends the previous one (same words made
+    longer, or new words with match_all) the previous matches are
+    narrowed instead of searching the whole sack again. A new request
+    cancels the running one, results are given back in chunks.
+    Background searches (update()) run one at a time in the session
+    worker thread, the sack is only read holding base.sack_lock.
+    '''
+
+    def __init__(self, base, fields, match_all=True, showdups=False, chunk_size=200):
+        self._base = base
+        self.fields = list(fields)
+        self.match_all = match_all
+        self.showdups = showdups
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._token = 0
+        self._thread = None
+        self._request = None
+        self._wakeup = threading.Event()
+        self._closed = False
+        # values, matches and sack generation of the last completed search
+        self._state = None
+
+    def _extends(self, values, state):
+        '''
+        returns if values can be answered narrowing the previous matches
+        '''
+        if state is None:
+            return False
+        old, matches, generation = state
+        if not old or not matches or generation != self._base.sack_generation:
+            return False
+        if len(values) < len(old) or (len(values) > len(old) and not self.match_all):
+            return False
+        for old_value, value in zip(old, values):
+            if old_value.lower() not in value.lower():
+                return False
+        return True
+
+    def _match(self, pkg, values):
+        for value in values:
+            found = False
+            for field in self.fields:
+                text = getattr(pkg, field, None)
+                if text and value in text.lower():
+                    found = True
+                    break
+            if self.match_all and not found:
+                return False
+            if not self.match_all and found:
+                return True
+        return self.match_all
+
+    def _chunks(self, pkgs):
+        '''
+        split pkgs into chunks keeping same name and arch packages together
+        '''
+        chunk = []
+        for na, group in itertools.groupby(sorted(pkgs, key=lambda p: (p.name, p.arch)),
+                                           key=lambda p: (p.name, p.arch)):
+            chunk.extend(group)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def cancel(self):
+        '''
+        cancel the running search if any
+        '''
+        self._next_token()
+
+    def _next_token(self):
+        with self._lock:
+            self._token += 1
+            return self._token
+
+    def results(self, text):
+        '''
+        return a generator of the packages matching text in chunks (lists),
+        it stops as soon as a newer search is started
+        '''
+        return self._results(text, self._next_token())
+
+    def _results(self, text, token):
+        values = text.split()
+        if not values:
+            return
+
+        base = self._base
+        with self._lock:
+            state = self._state
+        with base.sack_lock:
+            generation = base.sack_generation
+            if self._extends(values, state):
+                lower_values = [v.lower() for v in values]
+                matches = []
+                for chunk in self._chunks(state[1]):
+                    if token != self._token:
+                        return
+                    matches.extend(p for p in chunk if self._match(p, lower_values))
+            else:
+                matches = list(base.search(self.fields, values, self.match_all, showdups=True))
+        with self._lock:
+            if token != self._token:
+                return
+            # only a completed search is used to narrow next ones
+            self._state = (values, matches, generation)
+
+        for chunk in self._chunks(matches):
+            if token != self._token:
+                return
+            if not self.showdups:
+                with base.sack_lock:
+                    chunk = base.sack.query().filter(pkg=chunk).latest().run()
+            yield chunk
+
+    def _worker(self):
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                self._wakeup.clear()
+                request, self._request = self._request, None
+                if self._closed:
+                    return
+            if request is None:
+                continue
+            text, token, callback = request
+            for chunk in self._results(text, token):
+                callback(chunk, False)
+            if token == self._token:
+                callback([], True)
+
+    def update(self, text, callback):
+        '''
+        search text in background, callback(chunk, done) is called for each
+        chunk and then with an empty chunk and done True, a running search
+        is cancelled. Callbacks are called from the session worker thread
+        '''
+        token = self._next_token()
+        with self._lock:
+            self._request = (text, token, callback)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name="dnf-search-session")
+                self._thread.daemon = True
+                self._thread.start()
+        self._wakeup.set()
+
+    def close(self):
+        '''
+        cancel the running search and stop the worker thread
+        '''
+        self.cancel()
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        self._wakeup.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
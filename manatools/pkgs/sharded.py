@@ -0,0 +1,267 @@
+# vim: set fileencoding=utf-8 :
+# vim: set et ts=4 sw=4:
+'''
+ManaTools is a generic launcher application that can run
+internal or external modules, such as system configuration tools.
+
+ManaTools is also a collection of configuration tools that allows
+users to configure most of their system components in a very simple,
+intuitive and attractive interface. It consists of some modules
+that can be also run as autonomous applications.
+
+Python-ManaTools is a python framework to write manatools application
+written in python, this project started from perl manatools experience
+and its aim is to give an easy and common interface to develop and add
+new modules based on libYui. Every modules can be run using QT, Gtk or
+ncurses interface.
+
+License: LGPLv2+
+
+Author:  Angelo Naselli <anaselli@linux.it>
+
+@package manatools.pkgs.sharded
+'''
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+# NOTE this module is imported by the worker processes, keep dnf out of it
+
+import os
+import re
+import bisect
+import multiprocessing
+import concurrent.futures
+from array import array
+from multiprocessing import shared_memory
+
+''' package fields exported to shared memory '''
+SHARDED_FIELDS = ('name', 'summary', 'description')
+''' field separator in the exported columns, never found in a needle '''
+SEPARATOR = b'\0'
+''' shards per worker, to balance the load '''
+SHARDS_PER_WORKER = 4
+
+# worker side attached columns: block name -> SharedMemory
+_attached = {}
+
+def _attach(name):
+    shm = _attached.get(name)
+    if shm is None:
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # python < 3.13, workers share the resource tracker of the
+            # owner process that unlinks the block
+            shm = shared_memory.SharedMemory(name=name)
+        _attached[name] = shm
+    return shm
+
+def _detach_others(names):
+    for name in list(_attached):
+        if name not in names:
+            try:
+                _attached.pop(name).close()
+            except BufferError:
+                pass
+
+def _scan(columns, lo, hi, fields, needles):
+    '''
+    return, for each needle, the sorted positions in [lo, hi) whose
+    fields contain it. columns is field -> (text buffer, offsets)
+    '''
+    result = []
+    for needle in needles:
+        hits = set()
+        if not needle:
+            hits.update(range(lo, hi))
+        else:
+            pattern = re.compile(re.escape(needle))
+            for field in fields:
+                text, offsets = columns[field]
+                pos = offsets[lo]
+                end = offsets[hi]
+                while True:
+                    m = pattern.search(text, pos, end)
+                    if m is None:
+                        break
+                    i = bisect.bisect_right(offsets, m.start()) - 1
+                    hits.add(i)
+                    # next package
+                    pos = offsets[i + 1]
+        result.append(sorted(hits))
+    return result
+
+def _worker_scan(manifest, lo, hi, fields, needles):
+    '''
+    process pool entry point, manifest is field -> (text block, offsets block, count)
+    '''
+    names = set()
+    for text_name, off_name, count in manifest.values():
+        names.add(text_name)
+        names.add(off_name)
+    _detach_others(names)
+    columns = {}
+    for field in fields:
+        text_name, off_name, count = manifest[field]
+        offsets = _attach(off_name).buf.cast('Q')[:count + 1]
+        columns[field] = (_attach(text_name).buf, offsets)
+    try:
+        return _scan(columns, lo, hi, fields, needles)
+    finally:
+        for text, offsets in columns.values():
+            offsets.release()
+
+
+class ShardedSearch:
+    '''
+    DnfBase.search() fanned out to a process pool. Name, summary and
+    description of every package of the sack are exported once per sack
+    generation as lower case UTF-8 columns in shared memory, each worker
+    scans a shard of them. Other fields are looked up in the sack by the
+    calling process. Case folding is the python one, hawkey matches
+    could differ for some non ASCII text.
+    '''
+
+    def __init__(self, base, workers=None):
+        self._base = base
+        self.workers = workers or os.cpu_count() or 1
+        self.generation = None
+        self._pkgs = []
+        self._pos = None
+        self._blocks = []
+        self._manifest = {}
+        self._columns = {}
+        self._shards = []
+        self._executor = None
+
+    def _release(self):
+        for text, offsets in self._columns.values():
+            offsets.release()
+            text.release()
+        self._columns = {}
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+        self._blocks = []
+        self._manifest = {}
+
+    def _block(self, data):
+        shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        shm.buf[:len(data)] = data
+        self._blocks.append(shm)
+        return shm
+
+    def export(self):
+        '''
+        export the columns of the current sack, if it changed
+        '''
+        if self.generation == self._base.sack_generation and self._columns:
+            return
+        self._release()
+        self._pkgs = self._base.sack.query().run()
+        self._pos = None
+        count = len(self._pkgs)
+        for field in SHARDED_FIELDS:
+            chunks = []
+            offsets = array('Q', [0])
+            total = 0
+            for pkg in self._pkgs:
+                data = (getattr(pkg, field, None) or '').lower().encode('utf-8', 'replace') + SEPARATOR
+                chunks.append(data)
+                total += len(data)
+                offsets.append(total)
+            text = self._block(b''.join(chunks))
+            offs = self._block(offsets.tobytes())
+            self._manifest[field] = (text.name, offs.name, count)
+            self._columns[field] = (text.buf[:total], offs.buf.cast('Q')[:count + 1])
+            if field == 'description':
+                # shards are balanced on the longest column
+                self._shards = self._split(offsets, count)
+        self.generation = self._base.sack_generation
+
+    def _split(self, offsets, count):
+        '''
+        shard boundaries with about the same amount of text each
+        '''
+        nshards = min(count, self.workers * SHARDS_PER_WORKER) or 1
+        total = offsets[count] if count else 0
+        bounds = [0]
+        for s in range(1, nshards):
+            i = bisect.bisect_left(offsets, total * s // nshards, 0, count)
+            if i > bounds[-1]:
+                bounds.append(i)
+        bounds.append(count)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            # spawn: the calling process could have running threads
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def _position(self, pkg):
+        if self._pos is None:
+            self._pos = dict((p, i) for i, p in enumerate(self._pkgs))
+        return self._pos.get(pkg)
+
+    def find(self, fields, values):
+        '''
+        return, for each value, the set of package positions having one
+        of fields containing it (case insensitive)
+        '''
+        self.export()
+        shared = [f for f in fields if f in self._manifest]
+        found = [set() for v in values]
+        if shared:
+            needles = [v.lower().encode('utf-8', 'replace') for v in values]
+            if self.workers <= 1 or len(self._shards) <= 1:
+                parts = [_scan(self._columns, lo, hi, shared, needles) for lo, hi in self._shards]
+            else:
+                futures = [self.executor.submit(_worker_scan, self._manifest, lo, hi, shared, needles)
+                           for lo, hi in self._shards]
+                parts = [f.result() for f in futures]
+            for part in parts:
+                for key_set, hits in zip(found, part):
+                    key_set.update(hits)
+        for attr in fields:
+            if attr in self._manifest:
+                continue
+            for key_set, value in zip(found, values):
+                for pkg in self._base.contains(attr, value).run():
+                    i = self._position(pkg)
+                    if i is not None:
+                        key_set.add(i)
+        return found
+
+    def search(self, fields, values, match_all=True, showdups=False, limit=None):
+        '''
+        same arguments and results of DnfBase.search()
+        '''
+        matches = set()
+        for key_set in self.find(fields, values):
+            if len(matches) == 0:
+                matches = key_set
+            else:
+                if match_all:
+                    matches &= key_set
+                else:
+                    matches |= key_set
+        result = [self._pkgs[i] for i in matches]
+        if not showdups:
+            result = self._base.sack.query().filter(pkg=result).latest()
+        if limit is not None:
+            result = list(result)[:limit]
+        return result
+
+    def close(self):
+        '''
+        stop the workers and free the shared memory
+        '''
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._release()
+        self.generation = None
@@ -0,0 +1,146 @@
+# vim: set fileencoding=utf-8 :
+# vim: set et ts=4 sw=4:
+'''
+ManaTools is a generic launcher application that can run
+internal or external modules, such as system configuration tools.
+
+ManaTools is also a collection of configuration tools that allows
+users to configure most of their system components in a very simple,
+intuitive and attractive interface. It consists of some modules
+that can be also run as autonomous applications.
+
+Python-ManaTools is a python framework to write manatools application
+written in python, this project started from perl manatools experience
+and its aim is to give an easy and common interface to develop and add
+new modules based on libYui. Every modules can be run using QT, Gtk or
+ncurses interface.
+
+License: LGPLv2+
+
+Author:  Angelo Naselli <anaselli@linux.it>
+
+@package manatools.pkgs.snapshot
+'''
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import glob
+import json
+import hashlib
+import hawkey
+
+''' rpmdb locations, old and new (rpm >= 4.17) ones '''
+RPMDB_PATHS = ('var/lib/rpm', 'usr/lib/sysimage/rpm')
+
+def cache_path(base, name):
+    '''
+    return the path of the manatools file "name" beside the dnf metadata cache
+    '''
+    return os.path.join(base.conf.cachedir, 'manatools', name)
+
+def rpmdb_cookie(root='/'):
+    '''
+    return a string changing every time the rpm database is modified
+    '''
+    try:
+        import rpm
+        ts = rpm.TransactionSet(root)
+        cookie = ts.dbCookie()
+        if cookie:
+            return cookie
+    except Exception:
+        # no rpm bindings or rpm < 4.16 without dbCookie()
+        pass
+
+    h = hashlib.sha1()
+    for d in RPMDB_PATHS:
+        path = os.path.join(root, d)
+        if not os.path.isdir(path):
+            continue
+        for f in sorted(os.listdir(path)):
+            st = os.stat(os.path.join(path, f))
+            h.update(("%s/%s %d %d;" % (d, f, st.st_mtime_ns, st.st_size)).encode('utf-8'))
+    return h.hexdigest()
+
+def repo_cachedir(repo):
+    '''
+    return the metadata cache directory of the given repo or None
+    '''
+    # not public API, it changed along dnf versions
+    try:
+        return repo._repo.getCachedir()
+    except AttributeError:
+        pass
+    cachedir = getattr(repo, '_cachedir', None)
+    if cachedir:
+        return cachedir
+    dirs = glob.glob(os.path.join(repo.basecachedir, '%s-*' % repo.id))
+    if dirs:
+        return max(dirs, key=os.path.getmtime)
+    return None
+
+def repo_checksum(repo):
+    '''
+    return the checksum of the cached repomd.xml of the given repo or None
+    '''
+    cachedir = repo_cachedir(repo)
+    if not cachedir:
+        return None
+    repomd = os.path.join(cachedir, 'repodata', 'repomd.xml')
+    try:
+        with open(repomd, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+
+class SackSnapshot:
+    '''
+    Inputs a sack is filled with: the repository metadata checksums and
+    the rpmdb cookie. Their key identifies the sack content, persisted
+    results derived from the sack (protected packages, search index)
+    are valid only for the same key. Excluded packages are not part of
+    the inputs, results depending on them need key(excludes=True).
+    '''
+
+    def __init__(self, base):
+        self._base = base
+
+    def inputs(self):
+        '''
+        return the current sack inputs as a dictionary
+        '''
+        conf = self._base.conf
+        repos = {}
+        for repo in self._base.repos.iter_enabled():
+            repos[repo.id] = repo_checksum(repo)
+        return {
+            'releasever' : conf.substitutions.get('releasever'),
+            'basearch'   : conf.substitutions.get('basearch'),
+            'installroot': conf.installroot,
+            'repos'      : repos,
+            'rpmdb'      : rpmdb_cookie(conf.installroot),
+        }
+
+    def excludes(self):
+        '''
+        return the sorted ids of the packages excluded from the sack
+        (excludepkgs configuration, skip_packages(), ...)
+        '''
+        sack = self._base.sack
+        excluded = sack.query(flags=hawkey.IGNORE_EXCLUDES).difference(sack.query())
+        return sorted("%s@%s" % (pkg, pkg.reponame) for pkg in excluded.run())
+
+    def key(self, inputs=None, excludes=False):
+        '''
+        return the sack key (sha256 of the inputs)
+        :param excludes: the excluded packages are part of the key
+        '''
+        if inputs is None:
+            inputs = self.inputs()
+        if excludes:
+            inputs = dict(inputs, excludes=self.excludes())
+        data = json.dumps(inputs, sort_keys=True).encode('utf-8')
+        return hashlib.sha256(data).hexdigest()
@@ -0,0 +1,182 @@
+# vim: set fileencoding=utf-8 :
+# vim: set et ts=4 sw=4:
+'''
+ManaTools is a generic launcher application that can run
+internal or external modules, such as system configuration tools.
+
+ManaTools is also a collection of configuration tools that allows
+users to configure most of their system components in a very simple,
+intuitive and attractive interface. It consists of some modules
+that can be also run as autonomous applications.
+
+Python-ManaTools is a python framework to write manatools application
+written in python, this project started from perl manatools experience
+and its aim is to give an easy and common interface to develop and add
+new modules based on libYui. Every modules can be run using QT, Gtk or
+ncurses interface.
+
+License: LGPLv2+
+
+Author:  Angelo Naselli <anaselli@linux.it>
+
+@package manatools.pkgs.watcher
+'''
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import select
+import ctypes
+import ctypes.util
+import threading
+
+import manatools.pkgs.snapshot as snapshot
+
+''' inotify flags (linux/inotify.h) '''
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+class _Inotify:
+    '''
+    minimal inotify binding on the rpmdb directories
+    '''
+
+    def __init__(self, paths):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        watched = 0
+        for path in paths:
+            if libc.inotify_add_watch(self.fd, path.encode('utf-8'), WATCH_MASK) >= 0:
+                watched += 1
+        if not watched:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch")
+
+    def wait(self, timeout):
+        '''
+        wait for events at most timeout seconds, returns if there were some
+        '''
+        ready, _w, _x = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class RpmdbWatcher:
+    '''
+    Watch the rpm database of a DnfBase and call DnfBase.refresh_system()
+    when it is changed outside of it (rpm, dnf, other tools).
+    inotify is used if available, the rpmdb cookie is polled otherwise;
+    either way the cookie tells if the database really changed.
+    The refresh and the callback run in the watcher thread, the base
+    sack and installed index are replaced there holding base.sack_lock,
+    DnfBase.apply_transaction() holds it so that the sack is not filled
+    again while a transaction runs
+    '''
+
+    def __init__(self, base, interval=2.0, settle=1.0, callback=None, use_inotify=True):
+        '''
+        :param base: the DnfBase to refresh
+        :param interval: seconds between cookie polls (or inotify waits)
+        :param settle: seconds without rpmdb writes before refreshing
+        :param callback: called as callback(added, removed) with the PkgKey
+                         lists of installed packages after a refresh
+        :param use_inotify: watch the rpmdb directories with inotify
+        '''
+        self._base = base
+        self.interval = interval
+        self.settle = settle
+        self.callback = callback
+        self.use_inotify = use_inotify
+        self._stop = threading.Event()
+        self._thread = None
+        if base.rpmdb_cookie is None:
+            base.rpmdb_cookie = snapshot.rpmdb_cookie(base.conf.installroot)
+
+    def _paths(self):
+        root = self._base.conf.installroot
+        paths = [os.path.join(root, d) for d in snapshot.RPMDB_PATHS]
+        return [p for p in paths if os.path.isdir(p)]
+
+    def check(self):
+        '''
+        refresh the base if the rpmdb changed, returns True if it did
+        '''
+        base = self._base
+        if snapshot.rpmdb_cookie(base.conf.installroot) == base.rpmdb_cookie:
+            return False
+        with base.sack_lock:
+            # a transaction of the base itself refreshed it meanwhile
+            if snapshot.rpmdb_cookie(base.conf.installroot) == base.rpmdb_cookie:
+                return False
+            added, removed = base.refresh_system()
+        if self.callback is not None:
+            self.callback(added, removed)
+        return True
+
+    def _check(self):
+        try:
+            self.check()
+        except Exception as e:
+            # keep watching, the base is refreshed at next change
+            print(e)
+
+    def _run(self):
+        notifier = None
+        if self.use_inotify:
+            try:
+                notifier = _Inotify(self._paths())
+            except (OSError, AttributeError, TypeError):
+                # no inotify, cookie polling only
+                notifier = None
+        try:
+            while not self._stop.is_set():
+                if notifier is None:
+                    if self._stop.wait(self.interval):
+                        break
+                    self._check()
+                    continue
+                if not notifier.wait(self.interval):
+                    continue
+                # a transaction writes many times, wait for it to finish
+                while not self._stop.is_set() and notifier.wait(self.settle):
+                    pass
+                self._check()
+        finally:
+            if notifier is not None:
+                notifier.close()
+
+    def start(self):
+        '''
+        watch in a background thread
+        '''
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="rpmdb-watcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -1,9 +1,27 @@
+import io
+import os
+import json
+import asyncio
+import time
+import tempfile
+import threading
 import unittest
+from unittest import mock
+
+import dnf.drpm
+import dnf.callback
+import dnf.exceptions
 
 from manatools.pkgs import functions
 from manatools.pkgs import dnfbackend
 from manatools.pkgs import packages
 from manatools.pkgs import progress
+from manatools.pkgs import instrument
+from manatools.pkgs import daemon
+from manatools.pkgs import client
+from manatools.pkgs import asyncbackend
+from manatools.pkgs import search
+from manatools.pkgs import snapshot
 
 
 class TestFunctions(unittest.TestCase):
@@ -22,6 +40,21 @@ class TestFunctions(unittest.TestCase):
     sz = functions.selectedSize(self.dnf_base)
     self.assertTrue(sz == 0)
 
+  def test_selectedSizeMemoized(self):
+    base = self.dnf_base
+    functions.select_by_package_names(base, ["bless"])
+    plan = functions.downloadPlan(base)
+    self.assertIs(functions.downloadPlan(base), plan)
+    self.assertEqual(functions.selectedSize(base), plan.download_size)
+    # reinstalls are downloaded too
+    installed = dict((packages.pkg_key(p), p) for p in base.packages.installed)
+    key = next(iter(base.packages.resolveKeys(installed.keys())))
+    pkg = installed[key]
+    base.packageQueue.add(pkg, 'ri')
+    self.assertIsNot(functions.downloadPlan(base), plan)
+    keys = [packages.pkg_key(p) for p in functions.packagesToInstall(base)]
+    self.assertIn(packages.pkg_key(pkg), keys)
+
   def test_getPackageByName(self):
     p_name="bless"
     p = functions.packageByName(self.dnf_base, p_name)
@@ -37,6 +70,10 @@ class TestFunctions(unittest.TestCase):
     fn_from_pkgid = packages.pkg_id_to_fullname(pkgid)
     fn = packages.fullname(p)
     self.assertEqual(fn, fn_from_pkgid, "pkg_id fullname")
+    key = packages.pkg_key(p)
+    self.assertEqual(str(key), pkgid)
+    self.assertTrue(packages.PkgKey.from_string(pkgid) is key)
+    self.assertEqual(fn, packages.pkg_id_to_fullname(key), "pkg_key fullname")
 
   def test_packagesProviding(self):
     p_name="dnf"
@@ -46,6 +83,23 @@ class TestFunctions(unittest.TestCase):
     for p in pl:
       print(" ", packages.fullname(p))
 
+  def test_packagesByNames(self):
+    found, missing = functions.packagesByNames(self.dnf_base, ["bless", "dnf", "no-such-package-name"])
+    self.assertEqual(found["bless"].name, "bless")
+    self.assertEqual(found["dnf"].name, "dnf")
+    self.assertEqual(missing, ["no-such-package-name"])
+
+  def test_packageQueue(self):
+    found, missing = functions.packagesByNames(self.dnf_base, ["bless", "btanks"])
+    queue = self.dnf_base.packageQueue
+    queue.add_many(found.values(), 'i')
+    self.assertEqual(queue.total(), 2)
+    self.assertEqual(len(queue.install_list()), 2)
+    self.assertEqual(queue.action(found["bless"]), 'i')
+    queue.remove_many(found.values())
+    self.assertEqual(queue.total(), 0)
+    self.assertEqual(queue.downloadsize(), 0)
+
   def test_packagesToInstall(self):
     name_list = ["btanks"]
     functions.select_by_package_names(self.dnf_base, name_list)
@@ -55,6 +109,214 @@ class TestFunctions(unittest.TestCase):
     for p in pl:
       print(" ", packages.fullname(p))
 
+  def test_packagesCache(self):
+    pkgs = self.dnf_base.packages
+    pkgs.invalidate()
+    hits = pkgs.cache_stats()['hits']
+    l = pkgs.all
+    self.assertTrue(pkgs.all is l)
+    self.assertEqual(pkgs.cache_stats()['hits'], hits + 1)
+    functions.skip_packages(self.dnf_base, ["bless"])
+    self.assertFalse(pkgs.all is l)
+
+  def test_iterPackages(self):
+    pkgs = self.dnf_base.packages
+    page = list(pkgs.iter_all(offset=10, limit=5))
+    self.assertEqual(page, pkgs.all[10:15])
+    self.assertEqual(len(list(pkgs.iter_installed(limit=3))), 3)
+
+  def test_recent(self):
+    pkgs = self.dnf_base.packages
+    limit = time.time() - 30 * 86400
+    expected = set(pkgs._filter_packages(p for p in pkgs.query.latest() if int(p.buildtime) > limit))
+    recent = pkgs.recent(30)
+    self.assertEqual(set(recent), expected)
+    times = [p.buildtime for p in recent]
+    self.assertEqual(times, sorted(times, reverse=True))
+    self.assertEqual(pkgs.recent(30, limit=2), recent[:2])
+
+  def test_recentInstalledAndAvailable(self):
+    pkgs = self.dnf_base.packages
+    recent = pkgs.recent(365000)
+    keys = [packages.pkg_key(p) for p in recent]
+    self.assertEqual(len(keys), len(set(keys)))
+    available = pkgs.resolveKeys([packages.pkg_key(p) for p in pkgs.installed])
+    both = [p for p in recent if packages.pkg_key(p) in available]
+    if not both:
+      self.skipTest('no package both installed and available')
+    # once, as the installed object
+    for pkg in both:
+      self.assertEqual(keys.count(packages.pkg_key(pkg)), 1)
+      self.assertTrue(pkg.installed)
+
+  def test_searchIndex(self):
+    fields = ['name', 'summary', 'description']
+    values = ['hex', 'edit']
+    plain = set(self.dnf_base.search(fields, values))
+    indexed = self.dnf_base.search(fields, values, use_index=True)
+    self.assertEqual(plain, set(indexed))
+    self.assertTrue(len(self.dnf_base.search(fields, values, limit=1, use_index=True)) <= 1)
+
+  def test_searchIndexCache(self):
+    built = search.SearchIndex(self.dnf_base)
+    built.build()
+    sack_key = snapshot.SackSnapshot(self.dnf_base).key()
+    built.save(sack_key)
+    loaded = search.SearchIndex(self.dnf_base)
+    self.assertTrue(loaded.load(sack_key))
+    self.assertFalse(search.SearchIndex(self.dnf_base).load('another sack'))
+    for field in search.INDEXED_FIELDS:
+      self.assertEqual(loaded.find(field, 'edit'), built.find(field, 'edit'))
+    # the cache is data only
+    with open(snapshot.cache_path(self.dnf_base, search.INDEX_CACHE), 'rb') as f:
+      self.assertEqual(json.loads(f.readline().decode('utf-8'))['format'], search.INDEX_FORMAT)
+
+  def test_searchIndexExcludes(self):
+    base = self.dnf_base
+    fields = ['name']
+    self.assertTrue(len(base.search(fields, ['bless'], use_index=True)) > 0)
+    sack = snapshot.SackSnapshot(base)
+    key, excludes_key = sack.key(), sack.key(excludes=True)
+    functions.skip_packages(base, ['bless'])
+    self.assertEqual(base.search(fields, ['bless'], use_index=True), [])
+    # persisted results are shared with sacks having other excludes
+    self.assertEqual(sack.key(), key)
+    self.assertNotEqual(sack.key(excludes=True), excludes_key)
+    other = functions.dnfBase(True)
+    self.assertTrue(len(other.search(fields, ['bless'], use_index=True)) > 0)
+    other.close()
+
+  def test_packagesToInstallKeepsQueue(self):
+    functions.select_by_package_names(self.dnf_base, ["bless"])
+    queue = self.dnf_base.packageQueue
+    before = (queue.get(), dict(queue.actions), queue.total())
+    pl = functions.packagesToInstall(self.dnf_base)
+    self.assertTrue(len(pl) > 0)
+    self.assertEqual((queue.get(), dict(queue.actions), queue.total()), before)
+    self.assertEqual(functions.packagesToInstall(self.dnf_base), pl)
+
+  def test_dryRun(self):
+    base = self.dnf_base
+    # an available package pulling in some dependencies
+    for pkg in base.packages.available[:200]:
+      base.packageQueue.add(pkg, 'i')
+      plan = base.dry_run()
+      if plan.ok and len(plan.installs) > 1:
+        break
+      base.packageQueue.remove(pkg)
+    self.assertTrue(plan.ok)
+    planner = base._planner
+    solved, reused = planner.solved, planner.reused
+    # memoized
+    self.assertIs(base.dry_run(), plan)
+    self.assertEqual((planner.solved, planner.reused), (solved, reused + 1))
+    # queuing a package already pulled in reuses the plan
+    dep = [p for p in plan.installs if packages.pkg_key(p) != packages.pkg_key(pkg)][0]
+    base.packageQueue.add(dep, 'i')
+    self.assertIs(base.dry_run(), plan)
+    self.assertEqual((planner.solved, planner.reused), (solved, reused + 2))
+    # any other change is solved again
+    base.packageQueue.remove(dep)
+    base.packageQueue.remove(pkg)
+    self.assertIsNot(base.dry_run(), plan)
+    self.assertEqual(planner.solved, solved + 1)
+    # allow_erasing is part of the key, the base goal is a copy
+    base.packageQueue.add(pkg, 'i')
+    self.assertIsNot(base.dry_run(allow_erasing=True), base.dry_run())
+    self.assertEqual(base._goal.req_length(), 0)
+
+  def test_export(self):
+    pkgs = self.dnf_base.packages
+    out = io.StringIO()
+    n = pkgs.export(out, 'installed', 'csv')
+    self.assertEqual(n, len(pkgs.installed))
+    self.assertEqual(len(out.getvalue().splitlines()), n + 1)
+    out = io.BytesIO()
+    pkgs.export(out, 'installed', 'binary', ('name', 'buildtime'))
+    out.seek(0)
+    columns = packages.read_binary(out)
+    self.assertEqual(list(columns.keys()), ['name', 'buildtime'])
+    self.assertEqual(columns['name'], [p.name for p in pkgs.installed])
+    columns = packages.export_columns(pkgs.iter_installed(limit=3), ('name', 'buildtime'))
+    self.assertEqual(columns['name'], [p.name for p in pkgs.installed[:3]])
+    self.assertEqual(len(columns['buildtime']), 3)
+
+  def test_shardedSearch(self):
+    fields = ['name', 'summary', 'description']
+    for values, match_all in ((['hex', 'edit'], True), (['hexedit', 'vim'], False)):
+      plain = set(self.dnf_base.search(fields, values, match_all))
+      sharded = set(self.dnf_base.search(fields, values, match_all, use_shards=True))
+      self.assertEqual(plain, sharded)
+    plain = set(self.dnf_base.search(['name'], ['kernel'], showdups=True))
+    self.assertEqual(plain, set(self.dnf_base.search(['name'], ['kernel'], showdups=True, use_shards=True)))
+    self.dnf_base.close()
+
+  def test_daemon(self):
+    path = os.path.join(tempfile.mkdtemp(), 'pkgs.sock')
+    d = daemon.PackageDaemon(path, self.dnf_base)
+    t = threading.Thread(target=d.serve_forever)
+    t.start()
+    try:
+      while not os.path.exists(path):
+        time.sleep(0.1)
+      conn = client.dnfBase(path=path)
+      kp = client.packageByName(conn, 'kernel')
+      self.assertEqual(kp.name, 'kernel')
+      client.selectPackage(conn, kp)
+      self.assertEqual(client.packagesToInstall(conn), [kp])
+      found, missing = client.packagesByNames(conn, ['kernel', 'no-such-package'])
+      self.assertEqual(missing, ['no-such-package'])
+      # the local queue is not touched
+      self.assertEqual(self.dnf_base.packageQueue.total(), 0)
+      conn.close()
+    finally:
+      d.shutdown()
+      t.join()
+
+  def test_lazySearch(self):
+    base = functions.dnfBase(lazy=True)
+    self.assertTrue(len(base.search(['name'], ['kernel'])) > 0)
+    base.close()
+
+  def test_lazyInstalledIndex(self):
+    base = functions.dnfBase(lazy=True)
+    installed = base.packages.installed
+    self.assertTrue(len(installed) > 0)
+    base.ensure_sack()
+    # the index follows the new sack
+    current = set(base.sack.query().installed().run())
+    for p in base.packages.installed:
+      self.assertTrue(p in current)
+    base.close()
+
+  def test_refreshSystem(self):
+    index = self.dnf_base.packages.installed_index
+    before = set(k for k, p in index.items())
+    generation = self.dnf_base.sack_generation
+    added, removed = self.dnf_base.refresh_system()
+    self.assertEqual((added, removed), ([], []))
+    self.assertTrue(self.dnf_base.sack_generation > generation)
+    self.assertEqual(before, set(k for k, p in index.items()))
+    self.assertIsNotNone(self.dnf_base.rpmdb_cookie)
+    w = self.dnf_base.watch_rpmdb(interval=0.1)
+    with self.dnf_base.sack_lock:
+      self.assertFalse(w.check())
+    self.dnf_base.close()
+
+  def test_instrument(self):
+    instrument.reset()
+    instrument.enable()
+    try:
+      self.dnf_base.packages.invalidate()
+      self.dnf_base.packages.all
+      functions.packagesByNames(self.dnf_base, ['kernel'])
+    finally:
+      instrument.disable()
+    stats = instrument.tracer.stats()
+    self.assertEqual(stats['functions.packagesByNames']['count'], 1)
+    self.assertTrue('packages.build' in stats)
+    print(instrument.summary())
+
   def test_unselectAllPackages(self):
     p_name = "kernel-desktop-latest"
     kp = functions.packageByName(self.dnf_base, p_name)
@@ -79,5 +341,501 @@ class TestFunctions(unittest.TestCase):
       if p.name == p_name:
         self.assertTrue(functions.is_protected(self.dnf_base, p))
 
+
+class TestProtected(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.conf_path = packages.PROTECTED_CONF_PATH
+    packages.PROTECTED_CONF_PATH = os.path.join(self.tmp.name, 'protected.d')
+    os.makedirs(packages.PROTECTED_CONF_PATH)
+    self.conf = os.path.join(packages.PROTECTED_CONF_PATH, 'test.conf')
+    self.base = functions.dnfBase(True, None)
+    # protected.json goes there
+    self.base.conf.cachedir = os.path.join(self.tmp.name, 'cache')
+    self.pkgs = self.base.packages
+
+  def tearDown(self):
+    packages.PROTECTED_CONF_PATH = self.conf_path
+    self.base.close()
+    self.tmp.cleanup()
+
+  def _write(self, names, mtime):
+    with open(self.conf, 'w') as f:
+      f.write('\n'.join(names) + '\n')
+    os.utime(self.conf, (mtime, mtime))
+
+  def _protected(self):
+    # returns (protected names, True if computed again, not loaded)
+    self.pkgs.refresh()
+    with mock.patch.object(self.pkgs, '_saveProtected',
+                           wraps=self.pkgs._saveProtected) as save:
+      names = set(p.name for p in self.pkgs.protected)
+    return names, save.called
+
+  def _with_requires(self):
+    # an installed package requiring another installed one
+    installed = self.base.sack.query().installed()
+    for pkg in self.pkgs.installed:
+      for req in pkg.requires:
+        for dep in installed.filter(provides=req).run():
+          if dep.name != pkg.name:
+            return pkg, dep
+    self.skipTest('no installed package requiring another one')
+
+  def test_none_vs_empty(self):
+    self.assertIsNone(self.pkgs._protected)
+    self.assertEqual(self._protected(), (set(), True))
+    self.assertEqual(self.pkgs._protected, {})
+    self.assertFalse(self.pkgs.isProtected(self.pkgs.installed[0]))
+    # an empty result is persisted too
+    self.assertEqual(self._protected(), (set(), False))
+
+  def test_mtime(self):
+    a, b = self.pkgs.installed[0].name, self.pkgs.installed[-1].name
+    self._write([a], 1000000000)
+    self.assertEqual(self._protected(), (set([a]), True))
+    self.assertEqual(self._protected(), (set([a]), False))
+    self._write([b], 1000000010)
+    self.assertEqual(self._protected(), (set([b]), True))
+
+  def test_sack_key(self):
+    name = self.pkgs.installed[0].name
+    self._write([name], 1000000000)
+    self.assertEqual(self._protected(), (set([name]), True))
+    with mock.patch.object(snapshot.SackSnapshot, 'key', return_value='other'):
+      self.assertEqual(self._protected(), (set([name]), True))
+      self.assertEqual(self._protected(), (set([name]), False))
+    self.assertEqual(self._protected(), (set([name]), True))
+
+  def test_recursive(self):
+    pkg, dep = self._with_requires()
+    self._write([pkg.name], 1000000000)
+    names, computed = self._protected()
+    self.assertNotIn(dep.name, names)
+    self.pkgs.protected_recursive = True
+    names, computed = self._protected()
+    self.assertTrue(computed)
+    self.assertIn(dep.name, names)
+    self.assertTrue(self.pkgs.isProtected(dep))
+    self.assertEqual(self._protected(), (names, False))
+
+
+class _FakeRepo:
+  def __init__(self, repo_id, delay=0.0, error=None):
+    self.id = repo_id
+    self.delay = delay
+    self.error = error
+    self.enabled = True
+
+  def set_progress_bar(self, pbar):
+    pass
+
+  def disable(self):
+    self.enabled = False
+
+
+class _FakeRepos:
+  def __init__(self, repos):
+    self._repos = repos
+
+  def iter_enabled(self):
+    return iter(self._repos)
+
+
+class _FakeLoadBase:
+  load_repos = dnfbackend.DnfBase.load_repos
+
+  def __init__(self, repos, load_workers, repo_timeout=None):
+    self.repos = _FakeRepos(repos)
+    self.load_workers = load_workers
+    self.repo_timeout = repo_timeout
+    self.repo_errors = {}
+    self.threads = []
+
+  def _load_repo(self, repo, started=None):
+    self.threads.append(threading.current_thread())
+    if started is not None:
+      started[repo.id] = time.time()
+    time.sleep(repo.delay)
+    return repo.error
+
+
+class _FakeSackBase:
+  ensure_sack = dnfbackend.DnfBase.ensure_sack
+
+  def __init__(self):
+    self._pbar = None
+    self._sack_level = dnfbackend.SACK_NONE
+    self._sack_lock = threading.RLock()
+    self._sack_loaded = threading.Condition(self._sack_lock)
+    self._loading_repos = False
+    self.loading = threading.Event()
+    self.loads = 0
+    self.fills = []
+
+  def load_repos(self, pbar=None):
+    self.loads += 1
+    self.loading.set()
+    time.sleep(0.3)
+    return {}
+
+  def fill_sack(self, load_system_repo=True, load_available_repos=True):
+    self.fills.append(load_available_repos)
+
+
+class TestEnsureSack(unittest.TestCase):
+  def test_system_while_loading(self):
+    base = _FakeSackBase()
+    loaders = [threading.Thread(target=base.ensure_sack) for i in range(2)]
+    loaders[0].start()
+    self.assertTrue(base.loading.wait(5))
+    loaders[1].start()
+    # installed packages do not wait for the repositories
+    start = time.time()
+    base.ensure_sack(False)
+    self.assertTrue(time.time() - start < 0.2)
+    self.assertEqual(base._sack_level, dnfbackend.SACK_SYSTEM)
+    for t in loaders:
+      t.join()
+    self.assertEqual(base._sack_level, dnfbackend.SACK_FULL)
+    self.assertEqual(base.loads, 1)
+    self.assertEqual(base.fills, [False, True])
+
+
+class TestLoadRepos(unittest.TestCase):
+  def test_concurrent(self):
+    error = Exception('broken')
+    repos = [_FakeRepo('r%d' % i, 0.05) for i in range(6)] + [_FakeRepo('bad', 0.0, error)]
+    base = _FakeLoadBase(repos, 3)
+    errors = base.load_repos()
+    self.assertEqual(sorted(errors.keys()), sorted(r.id for r in repos))
+    self.assertIs(errors['bad'], error)
+    self.assertEqual(len([e for e in errors.values() if e is None]), 6)
+    self.assertTrue(all(t.daemon for t in base.threads))
+
+  def test_timeout(self):
+    slow = [_FakeRepo('slow%d' % i, 2.0) for i in range(2)]
+    repos = slow + [_FakeRepo('r%d' % i, 0.01) for i in range(3)]
+    base = _FakeLoadBase(repos, 2, 0.2)
+    start = time.time()
+    errors = base.load_repos()
+    self.assertTrue(time.time() - start < 1.5)
+    for repo in slow:
+      self.assertIsNotNone(errors[repo.id])
+      self.assertFalse(repo.enabled)
+    # the other repositories are loaded by a new worker
+    self.assertEqual([errors['r%d' % i] for i in range(3)], [None] * 3)
+
+  def test_timeout_one_worker(self):
+    slow = _FakeRepo('slow', 2.0)
+    repos = [slow] + [_FakeRepo('r%d' % i, 0.01) for i in range(2)]
+    base = _FakeLoadBase(repos, 1, 0.2)
+    start = time.time()
+    errors = base.load_repos()
+    self.assertTrue(time.time() - start < 1.5)
+    self.assertIsNotNone(errors['slow'])
+    self.assertFalse(slow.enabled)
+    self.assertEqual([errors['r0'], errors['r1']], [None, None])
+
+  def test_live(self):
+    base = functions.dnfBase(True, None, load_workers=4)
+    self.assertTrue(all(e is None for e in base.repo_errors.values()))
+    self.assertTrue(len(base.packages.all) > 0)
+    base.close()
+
+
+class _FakeAsyncBase:
+  created = 0
+
+  def __init__(self, **kwargs):
+    _FakeAsyncBase.created += 1
+    time.sleep(0.1)
+    self.kwargs = kwargs
+    self.closed = False
+
+  def search(self, fields, values, match_all=True, showdups=False, limit=None, use_index=False):
+    return iter(values)
+
+  def close(self):
+    self.closed = True
+
+
+class TestAsync(unittest.TestCase):
+  def test_rwlock(self):
+    events = []
+
+    async def reader(lock, name, delay):
+      await lock.acquire_read()
+      events.append(name + '+')
+      await asyncio.sleep(delay)
+      events.append(name + '-')
+      await lock.release_read()
+
+    async def writer(lock, name):
+      await lock.acquire_write()
+      events.append(name + '+')
+      await asyncio.sleep(0.01)
+      events.append(name + '-')
+      await lock.release_write()
+
+    async def main():
+      lock = asyncbackend.ReadWriteLock()
+      first = asyncio.ensure_future(reader(lock, 'r1', 0.05))
+      second = asyncio.ensure_future(reader(lock, 'r2', 0.05))
+      await asyncio.sleep(0.01)
+      w = asyncio.ensure_future(writer(lock, 'w'))
+      await asyncio.sleep(0.01)
+      # a reader coming after a waiting writer waits for it
+      late = asyncio.ensure_future(reader(lock, 'r3', 0.0))
+      await asyncio.gather(first, second, w, late)
+
+    asyncio.run(main())
+    # readers run together, the writer alone, then the late reader
+    self.assertEqual(set(events[:2]), set(['r1+', 'r2+']))
+    self.assertEqual(events[4:], ['w+', 'w-', 'r3+', 'r3-'])
+
+  def test_facade(self):
+    adb = asyncbackend.AsyncDnfBase(max_workers=2, lazy=True)
+    _FakeAsyncBase.created = 0
+
+    async def main():
+      bases = await asyncio.gather(adb.load(), adb.load(), adb.load())
+      found = await adb.search(['name'], ['a', 'b'])
+      return bases, found
+
+    with mock.patch.object(asyncbackend.dnfbackend, 'DnfBase', _FakeAsyncBase):
+      bases, found = asyncio.run(main())
+    self.assertEqual(_FakeAsyncBase.created, 1)
+    self.assertTrue(bases[0] is bases[1] is bases[2])
+    self.assertEqual(bases[0].kwargs, {'lazy': True})
+    self.assertEqual(found, ['a', 'b'])
+    adb.close()
+    self.assertTrue(bases[0].closed)
+
+
+class _FakeSearchPkg:
+  def __init__(self, name, summary):
+    self.name = name
+    self.arch = 'noarch'
+    self.summary = summary
+
+
+class _FakeSearchBase:
+  def __init__(self, pkgs):
+    self.pkgs = pkgs
+    self.sack_generation = 1
+    self.sack_lock = threading.RLock()
+    self.searches = 0
+
+  def search(self, fields, values, match_all=True, showdups=False, limit=None, use_index=False):
+    self.searches += 1
+    values = [v.lower() for v in values]
+    match = all if match_all else any
+    return [p for p in self.pkgs
+            if match(any(v in (getattr(p, f, None) or '').lower() for f in fields) for v in values)]
+
+
+class TestSearchSession(unittest.TestCase):
+  def setUp(self):
+    pkgs = [_FakeSearchPkg('hexedit', 'view and edit files in hexadecimal'),
+            _FakeSearchPkg('hexchat', 'irc client'),
+            _FakeSearchPkg('vim', 'text editor'),
+            _FakeSearchPkg('ghex', 'hex editor for gnome')]
+    self.base = _FakeSearchBase(pkgs)
+    self.session = search.SearchSession(self.base, ['name', 'summary'], showdups=True, chunk_size=1)
+
+  def _names(self, text):
+    return sorted(p.name for chunk in self.session.results(text) for p in chunk)
+
+  def test_narrowing(self):
+    self.assertEqual(self._names('he'), ['ghex', 'hexchat', 'hexedit'])
+    self.assertEqual(self.base.searches, 1)
+    # longer words and new words narrow the previous matches
+    self.assertEqual(self._names('hex'), ['ghex', 'hexchat', 'hexedit'])
+    self.assertEqual(self._names('hex edit'), ['ghex', 'hexedit'])
+    self.assertEqual(self.base.searches, 1)
+    # not an extension of the previous text
+    self.assertEqual(self._names('vim'), ['vim'])
+    self.assertEqual(self.base.searches, 2)
+    # a new sack is searched again
+    self.base.sack_generation += 1
+    self.assertEqual(self._names('vim'), ['vim'])
+    self.assertEqual(self.base.searches, 3)
+
+  def test_cancel(self):
+    results = self.session.results('hex')
+    self.session.cancel()
+    self.assertEqual(list(results), [])
+    # a newer search makes the previous one stale
+    first = self.session.results('hex')
+    second = self.session.results('edit')
+    self.assertEqual(list(first), [])
+    self.assertEqual(sorted(p.name for chunk in second for p in chunk), ['ghex', 'hexedit', 'vim'])
+
+  def test_stale_state(self):
+    self.assertEqual(self._names('hex'), ['ghex', 'hexchat', 'hexedit'])
+    stale = self.session.results('hexe')
+    self.assertEqual(self._names('vim'), ['vim'])
+    self.assertEqual(list(stale), [])
+    # the last completed search is narrowed, not the stale one
+    searches = self.base.searches
+    self.assertEqual(self._names('vim text'), ['vim'])
+    self.assertEqual(self.base.searches, searches)
+
+  def test_update(self):
+    chunks = []
+    done = threading.Event()
+    threads = set()
+
+    def callback(chunk, last):
+      threads.add(threading.current_thread())
+      chunks.append(chunk)
+      if last:
+        done.set()
+
+    self.session.update('hex', callback)
+    self.assertTrue(done.wait(5))
+    self.assertEqual(chunks[-1], [])
+    self.assertEqual(len(chunks), 4)
+    done.clear()
+    self.session.update('vim', callback)
+    self.assertTrue(done.wait(5))
+    # one worker thread for the session
+    self.assertEqual(len(threads), 1)
+    self.session.close()
+    self.assertFalse(list(threads)[0].is_alive())
+
+class _FakePayload:
+  def __init__(self, pkg):
+    self.pkg = pkg
+
+
+class _FakeDeltaPayload(dnf.drpm.DeltaPayload):
+  def __init__(self, pkg):
+    self.pkg = pkg
+
+
+class _FakeDownloadPlan:
+  def __init__(self, pkgs):
+    self._pkgs = list(pkgs)
+    self.download_size = 0
+
+  def packages(self, kind):
+    return []
+
+  def to_download(self):
+    return self._pkgs
+
+
+class _FakeConf:
+  def __init__(self):
+    self.max_parallel_downloads = 3
+
+
+class _FakeDownloadBase:
+  download_and_verify = dnfbackend.DnfBase.download_and_verify
+
+  def __init__(self, bad=()):
+    self.conf = _FakeConf()
+    self.bad = bad
+    self.batches = []
+    self.verified = []
+
+  def verify_package(self, pkg, checksum=True):
+    self.verified.append(pkg)
+    return "%s: checksum mismatch" % pkg if pkg in self.bad else None
+
+  def download_packages(self, pkgs, progress):
+    self.batches.append(list(pkgs))
+    for pkg in pkgs:
+      progress.end(_FakePayload(pkg), dnf.callback.STATUS_OK, None)
+    # let the verifier catch up
+    time.sleep(0.1)
+
+
+class TestDownloadAndVerify(unittest.TestCase):
+  def test_end_status(self):
+    verified = []
+    vbar = dnfbackend._VerifyingProgress(None, lambda pkg, checksum: verified.append((pkg, checksum)))
+    vbar.end(_FakePayload('a'), dnf.callback.STATUS_OK, None)
+    vbar.end(_FakePayload('b'), dnf.callback.STATUS_FAILED, 'error')
+    # the .drpm has landed, the package is not rebuilt yet
+    vbar.end(_FakeDeltaPayload('c'), dnf.callback.STATUS_OK, None)
+    self.assertEqual(verified, [('a', True)])
+    vbar.end(_FakeDeltaPayload('c'), dnf.callback.STATUS_DRPM, 'done')
+    vbar.end(_FakeDeltaPayload('d'), dnf.callback.STATUS_FAILED, 'error')
+    self.assertEqual(verified, [('a', True), ('c', False)])
+
+  def _download(self, base, pkgs):
+    plan = lambda dnf_base, pkgs, progress=None, verify=False: _FakeDownloadPlan(pkgs)
+    with mock.patch.object(dnfbackend.download, 'plan', plan):
+      base.download_and_verify(pkgs, None, max_parallel=5, batch_size=2)
+
+  def test_verified(self):
+    base = _FakeDownloadBase()
+    pkgs = ['a', 'b', 'c', 'd', 'e']
+    self._download(base, pkgs)
+    self.assertEqual(len(base.batches), 3)
+    self.assertEqual(sorted(base.verified), pkgs)
+    self.assertEqual(base.conf.max_parallel_downloads, 3)
+
+  def test_fail_fast(self):
+    base = _FakeDownloadBase(bad=('b',))
+    with self.assertRaises(dnf.exceptions.Error) as cm:
+      self._download(base, ['a', 'b', 'c', 'd', 'e', 'f'])
+    self.assertTrue('b: checksum mismatch' in str(cm.exception))
+    # the next batches are not downloaded
+    self.assertEqual(base.batches, [['a', 'b']])
+    self.assertEqual(base.conf.max_parallel_downloads, 3)
+
+
+class TestProgress(unittest.TestCase):
+  def _progress(self, clock):
+    states = []
+    sink = progress.CallbackSink(lambda state: states.append(state))
+    p = progress.Progress([sink], min_interval=0.2, min_step=1, refresh_interval=1.0)
+    with mock.patch.object(progress, 'time', lambda: clock[0]):
+      p.start(1, 1000)
+    return p, states
+
+  def _rendered(self, states):
+    return [s for s in states if s['event'] == 'progress']
+
+  def test_throttle(self):
+    clock = [100.0]
+    p, states = self._progress(clock)
+    with mock.patch.object(progress, 'time', lambda: clock[0]):
+      p.progress('pkg', 0)
+      p.progress('pkg', 100)
+      self.assertEqual(len(self._rendered(states)), 1)
+      # a step is not rendered before min_interval
+      clock[0] += 0.125
+      p.progress('pkg', 200)
+      self.assertEqual(len(self._rendered(states)), 1)
+      clock[0] += 0.125
+      p.progress('pkg', 300)
+      self.assertEqual(len(self._rendered(states)), 2)
+      self.assertEqual(self._rendered(states)[-1]['percent'], 30)
+      # less than a step is not rendered after min_interval
+      clock[0] += 0.5
+      p.progress('pkg', 301)
+      self.assertEqual(len(self._rendered(states)), 2)
+
+  def test_refresh_flat_percentage(self):
+    clock = [100.0]
+    p, states = self._progress(clock)
+    with mock.patch.object(progress, 'time', lambda: clock[0]):
+      p.progress('pkg', 0)
+      clock[0] += 1.0
+      p.progress('pkg', 500)
+      rate = self._rendered(states)[-1]['rate']
+      clock[0] += 1.0
+      p.progress('pkg', 501)
+      rendered = self._rendered(states)
+      self.assertEqual(len(rendered), 2)
+      self.assertEqual(rendered[-1]['percent'], 50)
+      self.assertTrue(rendered[-1]['rate'] < rate)
+      self.assertIsNotNone(rendered[-1]['eta'])
+
 if __name__ == '__main__':
     unittest.main()